@@ -3,84 +3,2046 @@ import requests
 import json
 import re
 import logging
+import random
+import threading
+import time
+import argparse
+import bisect
+import csv
+import socket
+import asyncio
+import functools
+import contextlib
+import email.utils
+import zlib
+import gzip
+import base64
+import collections
+import hashlib
+import hmac
+import importlib.util
+import signal
+import sqlite3
+import multiprocessing
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qsl, urlencode, urlparse, urlsplit, urlunsplit
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+try:
+    import fcntl
+except ImportError:
+    # Windows; IDF model saves then aren't serialized across processes
+    fcntl = None
 
 # Constants and Initializations
 SQUABBLES_TOKEN = os.environ.get('SQUABBLES_TOKEN')
 GIST_TOKEN = os.environ.get('GITHUB_TOKEN')
 GIST_ID = os.environ.get('TLDRBOT_GIST')
 FILE_NAME = 'tldrbot.json'
-GIST_URL = f"https://gist.githubusercontent.com/amightybeard/{GIST_ID}/raw/{FILE_NAME}"
+GIST_URL = os.environ.get('TLDRBOT_GIST_URL', f"https://gist.githubusercontent.com/amightybeard/{GIST_ID}/raw/{FILE_NAME}")
+SQUABBLR_API = os.environ.get('SQUABBLR_API', 'https://squabblr.co/api')
+TLDRTHIS_URL = os.environ.get('TLDRTHIS_URL', 'https://tldrthis.com/tldr/process-text/')
+GITHUB_API = os.environ.get('GITHUB_API', 'https://api.github.com')
+RAPIDAPI_KEY = os.environ.get('RAPIDAPI_KEY')
+RAPIDAPI_URL = os.environ.get('RAPIDAPI_URL', 'https://tldrthis.p.rapidapi.com/v1/model/extractive/summarize-text/')
+RAPIDAPI_HOST = os.environ.get('RAPIDAPI_HOST', urlparse(RAPIDAPI_URL).hostname)
+SQUABBLR_HOST = urlparse(SQUABBLR_API).netloc
+TLDRTHIS_HOST = urlparse(TLDRTHIS_URL).netloc
+GITHUB_HOST = urlparse(GITHUB_API).netloc
+LOCAL_HOST = 'local'  # runner key for calls that only touch local SQLite state
+CONCURRENCY = int(os.environ.get('TLDRBOT_CONCURRENCY', '16'))
+HOST_CONCURRENCY = int(os.environ.get('TLDRBOT_HOST_CONCURRENCY', '4'))
+
+# HTTP client settings
+HTTP_TIMEOUT = (float(os.environ.get('TLDRBOT_CONNECT_TIMEOUT', '5')), float(os.environ.get('TLDRBOT_READ_TIMEOUT', '60')))
+HTTP_RETRIES = int(os.environ.get('TLDRBOT_HTTP_RETRIES', '3'))
+HTTP_BACKOFF = float(os.environ.get('TLDRBOT_HTTP_BACKOFF', '0.5'))
+HTTP_BACKOFF_MAX = 30.0
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'PATCH', 'DELETE'}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+CAPTURE_RECORD_PATH = os.environ.get('TLDRBOT_RECORD')  # capture every upstream exchange to this file
+CAPTURE_REPLAY_PATH = os.environ.get('TLDRBOT_REPLAY')  # serve upstream exchanges from this capture
+CAPTURE_REPLAY_SPEED = float(os.environ.get('TLDRBOT_REPLAY_SPEED', '1'))  # 0 replays without delays
+
+# Rate limit settings, in requests per second per host
+RATE_LIMITS = {SQUABBLR_HOST: 5.0, TLDRTHIS_HOST: 2.0, GITHUB_HOST: 1.0}
+RATE_LIMITS.update(
+    (host, float(rate)) for host, rate in
+    (entry.split('=', 1) for entry in os.environ.get('TLDRBOT_RATE_LIMITS', '').split(',') if '=' in entry)
+)
+RATE_LIMIT_BURST = float(os.environ.get('TLDRBOT_RATE_LIMIT_BURST', '5'))
+RATE_LIMIT_MIN = 0.05
+RATE_LIMIT_RECOVERY = 0.05
+THROTTLE_STATUSES = {429, 503}
+RETRY_AFTER_MAX = float(os.environ.get('TLDRBOT_RETRY_AFTER_MAX', '60'))  # longest a Retry-After holds requests
+
+# Checkpoint settings
+STATE_DIR = os.environ.get('TLDRBOT_STATE_DIR', '.tldrbot')
+CHECKPOINT_JOURNAL = os.path.join(STATE_DIR, 'checkpoints.journal')
+CHECKPOINT_FLUSH = os.environ.get('TLDRBOT_CHECKPOINT_FLUSH', 'run')  # 'community' or 'run'
+CHECKPOINT_INTERVAL = float(os.environ.get('TLDRBOT_CHECKPOINT_INTERVAL', '60'))
+CHECKPOINT_MAX_PENDING = int(os.environ.get('TLDRBOT_CHECKPOINT_MAX_PENDING', '20'))
+
+# State settings
+STATE_BACKEND = os.environ.get('TLDRBOT_STATE_BACKEND', 'sqlite')  # 'sqlite' or 'gist'
+STATE_DB_PATH = os.path.join(STATE_DIR, 'state.sqlite')
+GIST_MIRROR = os.environ.get('TLDRBOT_GIST_MIRROR', '1' if GIST_ID else '0') == '1'
+GIST_MIRROR_INTERVAL = float(os.environ.get('TLDRBOT_GIST_MIRROR_INTERVAL', '60'))
+
+# Community registry settings
+COMMUNITY_REGISTRY_PATH = os.environ.get('TLDRBOT_COMMUNITIES', 'includes/communities.csv')  # '' leaves the list to the state backend
+REGISTRY_CHECK_INTERVAL = float(os.environ.get('TLDRBOT_REGISTRY_CHECK_INTERVAL', '10'))
+
+# Sharding settings
+SHARDING = os.environ.get('TLDRBOT_SHARDING', '0') == '1'
+WORKER_ID = os.environ.get('TLDRBOT_WORKER_ID', f"{socket.gethostname()}-{os.getpid()}")
+LEASE_TTL = float(os.environ.get('TLDRBOT_LEASE_TTL', '30'))
+SHARD_VIRTUAL_NODES = 64
+SHARD_LOAD_FACTOR = 1.25  # most communities a worker takes, relative to an even split
+
+# Listing settings
+LISTING_MAX_PAGES = int(os.environ.get('TLDRBOT_MAX_PAGES', '5'))
+LISTING_VALIDATORS_PATH = os.path.join(STATE_DIR, 'listing-validators.json')
+
+# Daemon settings
+POLL_MIN_INTERVAL = float(os.environ.get('TLDRBOT_POLL_MIN_INTERVAL', '30'))
+POLL_MAX_INTERVAL = float(os.environ.get('TLDRBOT_POLL_MAX_INTERVAL', '900'))
+POLL_TARGET_POSTS = float(os.environ.get('TLDRBOT_POLL_TARGET_POSTS', '1'))
+POLL_RATE_SMOOTHING = 0.3
+
+# Push ingestion settings
+INGEST_PORT = int(os.environ.get('TLDRBOT_INGEST_PORT', '0'))  # 0 turns the endpoint off
+INGEST_HOST = os.environ.get('TLDRBOT_INGEST_HOST', '127.0.0.1')  # any other address needs a token
+INGEST_TOKEN = os.environ.get('TLDRBOT_INGEST_TOKEN')  # bearer token senders must present
+INGEST_RECONCILE_INTERVAL = float(os.environ.get('TLDRBOT_RECONCILE_INTERVAL', '900'))  # polling sweep with push on
+INGEST_MAX_BODY = 1024 * 1024
+INGEST_ENQUEUE_TIMEOUT = 5.0
+
+# Metrics settings
+# Sharded workers share STATE_DIR, so each writes its own metrics
+METRICS_NAME = f'metrics-{WORKER_ID}' if SHARDING else 'metrics'
+METRICS_JSON_PATH = os.path.join(STATE_DIR, f'{METRICS_NAME}.json')
+METRICS_PROM_PATH = os.path.join(STATE_DIR, f'{METRICS_NAME}.prom')
+METRICS_PORT = int(os.environ.get('TLDRBOT_METRICS_PORT', '0'))
+METRICS_HOST = os.environ.get('TLDRBOT_METRICS_HOST', '127.0.0.1')  # the endpoint has no auth
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Pipeline settings
+PIPELINE_QUEUE_SIZE = int(os.environ.get('TLDRBOT_QUEUE_SIZE', '64'))
+PIPELINE_WORKERS = {
+    'fetch': int(os.environ.get('TLDRBOT_FETCH_WORKERS', '4')),
+    'filter': int(os.environ.get('TLDRBOT_FILTER_WORKERS', '1')),
+    'summarize': int(os.environ.get('TLDRBOT_SUMMARIZE_WORKERS', '8')),
+    'reply': int(os.environ.get('TLDRBOT_REPLY_WORKERS', '2')),
+    'checkpoint': int(os.environ.get('TLDRBOT_CHECKPOINT_WORKERS', '1')),
+}
+
+# Circuit breaker and hedging settings, for remote summarizers
+BREAKER_WINDOW = int(os.environ.get('TLDRBOT_BREAKER_WINDOW', '20'))  # recent calls judged
+BREAKER_MIN_CALLS = 5
+BREAKER_FAILURE_RATE = float(os.environ.get('TLDRBOT_BREAKER_FAILURE_RATE', '0.5'))
+BREAKER_SLOW_SECONDS = float(os.environ.get('TLDRBOT_BREAKER_SLOW_SECONDS', '20'))
+BREAKER_SLOW_RATE = float(os.environ.get('TLDRBOT_BREAKER_SLOW_RATE', '0.5'))
+BREAKER_COOLDOWN = float(os.environ.get('TLDRBOT_BREAKER_COOLDOWN', '30'))
+SUMMARY_DEADLINE = float(os.environ.get('TLDRBOT_SUMMARY_DEADLINE', '90'))
+HEDGE = os.environ.get('TLDRBOT_HEDGE', '0') == '1'
+HEDGE_MIN_DELAY = 0.2
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MAX_INFLIGHT = int(os.environ.get('TLDRBOT_HEDGE_MAX_INFLIGHT', '4'))
+
+# Summarizer settings
+SUMMARIZER = os.environ.get('TLDRBOT_SUMMARIZER', 'tldrthis')  # 'tldrthis', 'rapidapi', 'extractive', 'bart' or several to race
+RACE_DEADLINE = float(os.environ.get('TLDRBOT_RACE_DEADLINE', '60'))
+RACE_MIN_WORDS = 10  # shorter summaries don't win a race
+SUMMARY_SENTENCES = int(os.environ.get('TLDRBOT_SUMMARY_SENTENCES', '5'))
+IDF_MODEL_PATH = os.path.join(STATE_DIR, 'idf-model.npz')
+IDF_FEATURES = 2 ** 18
+TEXTRANK_DAMPING = 0.85
+ARTICLE_MAX_BYTES = int(os.environ.get('TLDRBOT_ARTICLE_MAX_BYTES', str(2 * 1024 * 1024)))
+ARTICLE_CHUNK_BYTES = 64 * 1024
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+HTML_PARSER = 'lxml' if importlib.util.find_spec('lxml') else 'html.parser'
+EXTRACT_WORKERS = int(os.environ.get('TLDRBOT_EXTRACT_WORKERS', str(os.cpu_count() or 1)))  # 0 parses in-thread
+EXTRACT_TIMEOUT = float(os.environ.get('TLDRBOT_EXTRACT_TIMEOUT', '60'))
+ARTICLE_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+# Constants for main content identification
+CONTENT_IDENTIFIERS = {
+    "apnews.com": "div.RichTextStoryBody",
+    "arstechnica.com": "div.article-content",
+    "technologyreview.com": "div.post-content__body",
+    "theverge.com": "article#content",
+    "thereporteronline.com": "div.article-body",
+    "foxbusiness.com": "div.article-body",
+    "foxnews.com": "div.article-body",
+    "bbc.com": 'article[class*="-ArticleWrapper"]',
+    "business-insider.com": "div.content-lock-content",
+    "npr.com": "div.storytext",
+    "thehill.com": ".article__text",
+    "channelnewsasia.com": "section.block-field-blocknodearticlefield-content",
+    "reuters.com": 'div[class*="article-body__content__"]',
+    "scientificamerican.com": "div.article-text"
+}
+
+AVOID_ELEMENTS = ["aside", "figure", "footer", "header"]
+AVOID_CLASSES = ["sidebar", "bxc", "byline", "ByLine", "caption", "ad"]
+
+# BART settings
+BART_MODEL_NAME = os.environ.get('TLDRBOT_BART_MODEL', 'facebook/bart-large-cnn')
+BART_MAX_BATCH = int(os.environ.get('TLDRBOT_BART_MAX_BATCH', '8'))
+BART_MAX_WAIT = float(os.environ.get('TLDRBOT_BART_MAX_WAIT', '0.25'))
+BART_QUANTIZE = os.environ.get('TLDRBOT_BART_QUANTIZE', '0') == '1'
+# Kept out of STATE_DIR, which the workflow caches between runs
+BART_ARTIFACT_DIR = os.environ.get('TLDRBOT_BART_ARTIFACT', os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'tldrbot', 'bart-int8' if BART_QUANTIZE else 'bart'))
+BART_MAX_INPUT_TOKENS = 1024
+BART_CHUNK_PARAGRAPHS = 5
+BART_SUMMARY_SENTENCES = 7
+BART_GENERATE_ARGS = {"max_length": 150, "min_length": 50, "length_penalty": 5.0, "num_beams": 2, "early_stopping": True}
+
+# Summary cache settings
+SUMMARY_CACHE_PATH = os.path.join(STATE_DIR, 'summaries.sqlite')
+SUMMARY_CACHE_TTL = float(os.environ.get('TLDRBOT_SUMMARY_TTL', str(7 * 24 * 3600)))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.environ.get('TLDRBOT_SUMMARY_MAX_ENTRIES', '10000'))
+TRACKING_PARAMS = {'fbclid', 'gclid', 'mc_cid', 'mc_eid', 'ref', 'cmpid'}
+TRACKING_PARAM_PREFIXES = ('utm_',)
+
+# Reply outbox settings
+OUTBOX_PATH = os.path.join(STATE_DIR, 'outbox.sqlite')
+OUTBOX_WORKERS = int(os.environ.get('TLDRBOT_OUTBOX_WORKERS', '4'))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('TLDRBOT_OUTBOX_MAX_ATTEMPTS', '5'))
+OUTBOX_DRAIN_TIMEOUT = float(os.environ.get('TLDRBOT_OUTBOX_DRAIN_TIMEOUT', '120'))  # seconds to wait at exit
+OUTBOX_STALE_SENDING = 600  # a send in progress this long belongs to a dead process
+
+# Near-duplicate settings
+NEAR_DUP = os.environ.get('TLDRBOT_NEAR_DUP', 'local')  # off, local (summarizers that read the article) or all
+NEAR_DUP_PATH = os.path.join(STATE_DIR, 'near-dups.sqlite')
+NEAR_DUP_DISTANCE = int(os.environ.get('TLDRBOT_NEAR_DUP_DISTANCE', '3'))  # max differing SimHash bits
+NEAR_DUP_MIN_WORDS = 50
+NEAR_DUP_SHINGLE = 3
+
+# Metrics
+class Metrics:
+    """
+    Counters, gauges and latency histograms keyed by name and labels, dumped
+    as JSON and Prometheus text at the end of a run or served by the daemon.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            index = 0
+            while index < len(self.buckets) and seconds > self.buckets[index]:
+                index += 1
+            histogram["counts"][index] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    @contextlib.contextmanager
+    def time(self, name, **labels):
+        """
+        Times the block into a histogram. The block can set labels['outcome'];
+        it defaults to 'ok', or 'error' when the block raises.
+        """
+        labels.setdefault('outcome', 'ok')
+        started = time.perf_counter()
+        try:
+            yield labels
+        except BaseException:
+            labels['outcome'] = 'error'
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def _quantile(self, histogram, fraction):
+        target = fraction * histogram["count"]
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), histogram["counts"]):
+            cumulative += count
+            if cumulative >= target:
+                # None when the quantile is past the last bucket
+                return bound if bound != float('inf') else None
+        return None
+
+    def snapshot(self):
+        with self.lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(self.counters.items())]
+            gauges = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(self.gauges.items())]
+            histograms = []
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                histograms.append({
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": histogram["count"],
+                    "sum": histogram["sum"],
+                    "buckets": dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], histogram["counts"])),
+                    "p50": self._quantile(histogram, 0.50),
+                    "p95": self._quantile(histogram, 0.95),
+                    "p99": self._quantile(histogram, 0.99),
+                })
+        return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            for kind, series in (('counter', self.counters), ('gauge', self.gauges)):
+                typed = set()
+                for (name, labels), value in sorted(series.items()):
+                    if name not in typed:
+                        lines.append(f"# TYPE {name} {kind}")
+                        typed.add(name)
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+            typed = set()
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip([str(bound) for bound in self.buckets] + ['+Inf'], histogram["counts"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {histogram['sum']}")
+                lines.append(f"{name}_count{self._labels(labels)} {histogram['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, json_path=METRICS_JSON_PATH, prom_path=METRICS_PROM_PATH):
+        os.makedirs(os.path.dirname(json_path) or '.', exist_ok=True)
+        with open(json_path, 'w') as file:
+            json.dump(self.snapshot(), file, indent=4)
+        with open(prom_path, 'w') as file:
+            file.write(self.prometheus())
+
+    def serve(self, port, host=METRICS_HOST):
+        """
+        Serves /metrics (Prometheus text) and /metrics.json from a background thread.
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = registry.prometheus().encode(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = json.dumps(registry.snapshot()).encode(), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+        return server
+
+metrics = Metrics()
+
+# Rate Limiting
+class TokenBucket:
+    """
+    Allows rate requests per second with bursts of up to burst. A 429 or 503
+    halves the rate and, with a Retry-After, holds every request until it
+    has passed, for at most RETRY_AFTER_MAX seconds; each success wins back
+    a little of the configured rate.
+    """
+    def __init__(self, rate, burst=RATE_LIMIT_BURST):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a request may be sent and returns the seconds waited.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def throttled(self, retry_after=None):
+        with self.lock:
+            self.rate = max(RATE_LIMIT_MIN, self.rate / 2)
+            self.tokens = 0.0
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + min(retry_after, RETRY_AFTER_MAX))
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_LIMIT_RECOVERY)
+
+class RateLimiter:
+    """
+    One TokenBucket per host in RATE_LIMITS; other hosts are not limited.
+    """
+    def __init__(self, rates=RATE_LIMITS):
+        self.rates = rates
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, host):
+        with self.lock:
+            if host not in self.buckets:
+                rate = self.rates.get(host)
+                self.buckets[host] = TokenBucket(rate) if rate else None
+            return self.buckets[host]
+
+    def scale(self, factor):
+        """
+        Multiplies every host's rate, to keep pace with a capture replayed
+        factor times faster; 0 lifts the limits.
+        """
+        with self.lock:
+            self.rates = {host: rate * factor for host, rate in self.rates.items()} if factor else {}
+            self.buckets = {}
+
+    def acquire(self, host):
+        bucket = self.bucket(host)
+        if bucket:
+            waited = bucket.acquire()
+            if waited:
+                metrics.observe('tldrbot_rate_limit_wait_seconds', waited, host=host)
+
+    def record(self, host, response):
+        bucket = self.bucket(host)
+        if not bucket:
+            return
+        if response.status_code in THROTTLE_STATUSES:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            bucket.throttled(retry_after)
+            metrics.inc('tldrbot_rate_limit_throttled_total', host=host, status=response.status_code)
+            logging.warning(f"{host} throttled us ({response.status_code}), slowing to {bucket.rate:.2f} requests/sec.")
+        else:
+            bucket.succeeded()
+        metrics.set('tldrbot_rate_limit_rps', bucket.rate, host=host)
+
+def parse_retry_after(value):
+    """
+    Returns a Retry-After header, in delta-seconds or HTTP-date form, as seconds.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+rate_limiter = RateLimiter()
+
+# Circuit Breaking
+class CircuitBreaker:
+    """
+    Stops calling an upstream that is failing or slow. The circuit opens
+    when, over the last window calls, the share that failed or the share
+    slower than slow_seconds reaches its threshold. After cooldown seconds a
+    single probe is let through (half-open): the circuit closes if it
+    succeeds in time and opens again if not. allow() hands out a ticket that
+    record() takes back, so results of calls let through before the circuit
+    last changed state, such as stragglers while half-open, are ignored.
+    """
+    CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name, window=BREAKER_WINDOW, failure_rate=BREAKER_FAILURE_RATE,
+                 slow_seconds=BREAKER_SLOW_SECONDS, slow_rate=BREAKER_SLOW_RATE, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.outcomes = collections.deque(maxlen=window)
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.epoch = object()  # ticket for calls while closed, renewed on every close
+        self.probe = None
+        self.lock = threading.Lock()
+
+    def _set(self, state):
+        if state != self.state:
+            print(f"Circuit for {self.name} is now {state.replace('_', '-')}")
+        self.state = state
+        metrics.set('tldrbot_circuit_state', self.STATE_VALUES[state], breaker=self.name)
+
+    def allow(self):
+        """
+        Returns a ticket to pass to record() if a call may go ahead, or None.
+        """
+        with self.lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self._set(self.HALF_OPEN)
+            if self.state == self.CLOSED:
+                return self.epoch
+            if self.state == self.HALF_OPEN and self.probe is None:
+                self.probe = object()
+                return self.probe
+        metrics.inc('tldrbot_circuit_rejected_total', breaker=self.name)
+        return None
+
+    def record(self, ticket, succeeded, elapsed):
+        slow = elapsed >= self.slow_seconds
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                if ticket is not self.probe:
+                    return
+                self.probe = None
+                if succeeded and not slow:
+                    self.outcomes.clear()
+                    self.epoch = object()
+                    self._set(self.CLOSED)
+                else:
+                    self._open()
+                return
+            if self.state != self.CLOSED or ticket is not self.epoch:
+                return
+            self.outcomes.append((not succeeded, slow))
+            if len(self.outcomes) < BREAKER_MIN_CALLS:
+                return
+            failures = sum(failed for failed, _ in self.outcomes) / len(self.outcomes)
+            slows = sum(slow for _, slow in self.outcomes) / len(self.outcomes)
+            if failures >= self.failure_rate or slows >= self.slow_rate:
+                self._open()
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self._set(self.OPEN)
+
+# HTTP Client
+def body_digest(body):
+    if body is None:
+        return None
+    if isinstance(body, str):
+        body = body.encode()
+    return hashlib.blake2b(body, digest_size=8).hexdigest() if isinstance(body, bytes) else None
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    Sends requests as usual and appends each exchange, with its start time
+    and duration, to a gzipped JSON-lines capture. Request headers, which
+    carry the tokens, are never written.
+    """
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.capture = gzip.open(path, 'wt')
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+
+    def send(self, request, **kwargs):
+        entry = {"t": round(time.monotonic() - self.started, 4), "method": request.method, "url": request.url,
+                 "body": body_digest(request.body)}
+        started = time.monotonic()
+        try:
+            response = super().send(request, **kwargs)
+            # Read streamed bodies here; the caller then reads them from memory
+            content = response.content
+        except requests.RequestException as e:
+            entry.update(elapsed=round(time.monotonic() - started, 4), error=e.__class__.__name__)
+            self._write(entry)
+            raise
+        entry.update(elapsed=round(time.monotonic() - started, 4), status=response.status_code,
+                     reason=response.reason, headers=dict(response.headers))
+        try:
+            entry["text"] = content.decode('utf-8')
+        except UnicodeDecodeError:
+            entry["content"] = base64.b64encode(content).decode('ascii')
+        self._write(entry)
+        return response
+
+    def _write(self, entry):
+        with self.lock:
+            if not self.capture.closed:
+                self.capture.write(json.dumps(entry) + "\n")
+
+    def close(self):
+        super().close()
+        with self.lock:
+            if not self.capture.closed:
+                self.capture.close()
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Answers requests from a capture made by RecordingAdapter, without any
+    network. A request gets the next unused exchange with the same method,
+    URL and body, or failing that the same method and URL, since reply and
+    Gist bodies change with the code under test. Each response is held back
+    for its recorded duration divided by speed; a speed of 0 serves at once.
+    """
+    def __init__(self, path, speed=CAPTURE_REPLAY_SPEED):
+        super().__init__()
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.exact = collections.defaultdict(collections.deque)
+        self.loose = collections.defaultdict(collections.deque)
+        with gzip.open(path, 'rt') as capture:
+            for line in capture:
+                entry = json.loads(line)
+                entry["used"] = False
+                self.exact[(entry["method"], entry["url"], entry["body"])].append(entry)
+                self.loose[(entry["method"], entry["url"])].append(entry)
+        self.served = 0
+        self.missed = 0
+
+    def _next(self, queue):
+        while queue and queue[0]["used"]:
+            queue.popleft()
+        if queue:
+            queue[0]["used"] = True
+            return queue.popleft()
+        return None
+
+    def send(self, request, **kwargs):
+        with self.lock:
+            entry = self._next(self.exact[(request.method, request.url, body_digest(request.body))])
+            entry = entry or self._next(self.loose[(request.method, request.url)])
+            if entry is None:
+                self.missed += 1
+            else:
+                self.served += 1
+        if entry is None:
+            metrics.inc('tldrbot_replay_total', result='missing')
+            raise requests.ConnectionError(f"{request.method} {request.url} is not in the capture", request=request)
+        metrics.inc('tldrbot_replay_total', result='served')
+        if self.speed > 0:
+            time.sleep(entry["elapsed"] / self.speed)
+        if "error" in entry:
+            raise getattr(requests, entry["error"], requests.ConnectionError)(f"Replayed {entry['error']}", request=request)
+
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = entry["reason"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = entry["text"].encode('utf-8') if "text" in entry else base64.b64decode(entry["content"])
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        # Mounted for both schemes, so this runs twice
+        with self.lock:
+            if self.served or self.missed:
+                print(f"Replayed {self.served} upstream responses ({self.missed} requests not in the capture)")
+            self.served = self.missed = 0
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """
+    Returns the process-wide session. Its adapters keep a pool of warm
+    keep-alive connections per host, shared by every thread. With a capture
+    path set, the session records to or replays from it.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            pool = dict(pool_connections=8, pool_maxsize=max(CONCURRENCY, HOST_CONCURRENCY))
+            if CAPTURE_REPLAY_PATH:
+                adapter = ReplayAdapter(CAPTURE_REPLAY_PATH, CAPTURE_REPLAY_SPEED)
+            elif CAPTURE_RECORD_PATH:
+                adapter = RecordingAdapter(CAPTURE_RECORD_PATH, **pool)
+            else:
+                adapter = HTTPAdapter(**pool)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+def close_session():
+    """
+    Closes the shared session's connections and finishes writing a capture.
+    """
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+
+def backoff_delay(attempt):
+    # Full jitter, so retries from concurrent workers don't land in lockstep
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF * 2 ** attempt))
+
+def http_request(method, url, retries=HTTP_RETRIES, **kwargs):
+    """
+    Sends a request through the shared session with a default timeout, paced
+    by the host's rate limit. Idempotent requests are retried with jittered
+    exponential backoff on connection errors and retryable statuses; other
+    requests are only retried on a 429 or when the connection was never
+    established, since then they were certainly not processed.
+    """
+    method = method.upper()
+    host = urlparse(url).netloc
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    idempotent = method in IDEMPOTENT_METHODS
+    attempt = 0
+    while True:
+        rate_limiter.acquire(host)
+        retry_after = None
+        try:
+            with metrics.time('tldrbot_http_request_seconds', host=host, method=method) as labels:
+                response = get_session().request(method, url, **kwargs)
+                labels['outcome'] = str(response.status_code)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            safe_to_retry = idempotent or isinstance(e, requests.ConnectTimeout)
+            if not safe_to_retry or attempt >= retries:
+                raise
+            logging.warning(f"{method} {url} failed ({e.__class__.__name__}), retrying.")
+        else:
+            rate_limiter.record(host, response)
+            retryable = response.status_code in RETRY_STATUSES and (idempotent or response.status_code == 429)
+            if not retryable or attempt >= retries:
+                return response
+            logging.warning(f"{method} {url} returned {response.status_code}, retrying.")
+            if response.status_code in THROTTLE_STATUSES:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None and rate_limiter.bucket(host):
+                # The host's bucket already holds the next attempt until Retry-After
+                metrics.inc('tldrbot_http_retries_total', host=host, method=method)
+                attempt += 1
+                continue
+        metrics.inc('tldrbot_http_retries_total', host=host, method=method)
+        time.sleep(max(min(retry_after or 0.0, RETRY_AFTER_MAX), backoff_delay(attempt)))
+        attempt += 1
 
 # Utility Functions
 def fetch_gist_data():
     headers = {'Authorization': f'token {GIST_TOKEN}'}
-    response = requests.get(GIST_URL, headers=headers)
+    response = http_request('GET', GIST_URL, headers=headers)
     response.raise_for_status()
     communities_data = response.json()
     print(f"Fetched data from Gist: {communities_data}")
     return communities_data
 
-def fetch_new_posts(community_name, last_processed_id):
-    response = requests.get(f'https://squabblr.co/api/s/{community_name}/posts?page=1&sort=new')
-    response.raise_for_status()
-    posts_data = response.json()  # Ensure this is parsed as JSON
-    posts = posts_data["data"] if "data" in posts_data else [] 
-    new_posts = [post for post in posts if post['id'] > last_processed_id]
-    print(f"Fetched new posts for community {community_name}")
-    return new_posts
+class ListingValidators:
+    """
+    ETag/Last-Modified of each community's first listing page. Validators are
+    staged when a page is fetched and only committed once every post on it has
+    been handled, so a 304 can never hide posts a crashed or failed run
+    didn't get to.
+    """
+    def __init__(self, path=LISTING_VALIDATORS_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.staged = {}
+        try:
+            with open(path) as file:
+                self.validators = json.load(file)
+        except (OSError, ValueError):
+            self.validators = {}
+
+    def headers(self, community_name):
+        validator = self.validators.get(community_name, {})
+        headers = {}
+        if validator.get("etag"):
+            headers['If-None-Match'] = validator["etag"]
+        if validator.get("last_modified"):
+            headers['If-Modified-Since'] = validator["last_modified"]
+        return headers
+
+    def stage(self, community_name, response):
+        validator = {"etag": response.headers.get('ETag'), "last_modified": response.headers.get('Last-Modified')}
+        with self.lock:
+            if validator["etag"] or validator["last_modified"]:
+                self.staged[community_name] = validator
+            else:
+                self.staged.pop(community_name, None)
+
+    def commit(self, community_name):
+        with self.lock:
+            if community_name in self.staged:
+                self.validators[community_name] = self.staged.pop(community_name)
+
+    def discard(self, community_name):
+        with self.lock:
+            self.staged.pop(community_name, None)
+            self.validators.pop(community_name, None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # Write and rename, since sharded workers save the same file
+        temp_path = f"{self.path}.{os.getpid()}"
+        with self.lock:
+            with open(temp_path, 'w') as file:
+                json.dump(self.validators, file)
+            os.replace(temp_path, self.path)
+
+def fetch_new_posts(community_name, last_processed_id, validators=None):
+    """
+    Pages through the newest posts until reaching last_processed_id or
+    LISTING_MAX_PAGES, so bursts that push posts off page 1 are not missed.
+    Hitting LISTING_MAX_PAGES first is logged and counted, since the older
+    new posts are then skipped for good.
+    With validators, page 1 is a conditional request and an unchanged listing
+    costs a 304 instead of a full download.
+    """
+    new_posts = []
+    for page in range(1, LISTING_MAX_PAGES + 1):
+        headers = validators.headers(community_name) if validators and page == 1 else {}
+        response = http_request('GET', f'{SQUABBLR_API}/s/{community_name}/posts', params={'page': page, 'sort': 'new'}, headers=headers)
+        if response.status_code == 304:
+            print(f"Listing for community {community_name} not modified")
+            return []
+        response.raise_for_status()
+        if validators and page == 1:
+            validators.stage(community_name, response)
+        posts_data = response.json()  # Ensure this is parsed as JSON
+        posts = posts_data["data"] if "data" in posts_data else [] 
+        new_posts.extend(post for post in posts if post['id'] > last_processed_id)
+        if not posts or min(post['id'] for post in posts) <= last_processed_id:
+            break
+    else:
+        # Posts between last_processed_id and the last page fetched are never seen
+        logging.warning(
+            f"Listing for community {community_name} still had new posts after {LISTING_MAX_PAGES} pages. "
+            f"Posts after ID {last_processed_id} and before ID {min(post['id'] for post in new_posts)} are skipped."
+        )
+        metrics.inc('tldrbot_listing_truncated_total', community=community_name)
+    # Oldest first, so last_processed_id only ever moves forward
+    new_posts.sort(key=lambda post: post['id'])
+    print(f"Fetched {len(new_posts)} new posts for community {community_name}")
+    return new_posts
+
+def latest_post_id(community_name):
+    """
+    Returns the id of the community's newest post, or 0 when it has none, so a
+    newly tracked community starts there instead of replying to its backlog.
+    """
+    response = http_request('GET', f'{SQUABBLR_API}/s/{community_name}/posts', params={'page': 1, 'sort': 'new'})
+    response.raise_for_status()
+    posts = response.json().get("data") or []
+    return max((post['id'] for post in posts), default=0)
+
+class DomainBlacklist:
+    """
+    Compiled form of includes/blacklist-domains.txt. Plain domains such as
+    youtu.be are stored in a character trie, which becomes one regex that
+    tries each shared prefix once, and every other entry is a regex. Both are
+    joined into one alternation searched once over the whole URL, so entries
+    still match anywhere in it, as in wrapper and redirect links, just as
+    when each entry was searched for on its own. Entries that would change
+    meaning or fail to compile inside the alternation, those with inline
+    flags or groups (which backreferences and named groups need), are still
+    searched for on their own.
+    """
+    PLAIN_DOMAIN = re.compile(r'^[A-Za-z0-9-]+(\.[A-Za-z0-9-]+)+$')
+    DEFAULT_FLAGS = re.compile('').flags
+
+    def __init__(self, patterns):
+        self.domains = {}
+        self.domain_count = 0
+        regexes = []
+        self.separate = []
+        for pattern in patterns:
+            if self.PLAIN_DOMAIN.match(pattern):
+                self._add_domain(pattern)
+                continue
+            try:
+                compiled = re.compile(pattern)
+            except re.error as e:
+                logging.error(f"Ignoring invalid blacklist pattern {pattern!r}. Error: {str(e)}")
+                continue
+            if compiled.groups or compiled.flags != self.DEFAULT_FLAGS:
+                self.separate.append(compiled)
+            else:
+                regexes.append(pattern)
+        self.regex_count = len(regexes) + len(self.separate)
+        if self.domains:
+            regexes.insert(0, self._trie_regex(self.domains))
+        self.regex = None
+        if regexes:
+            try:
+                self.regex = re.compile('|'.join(f'(?:{pattern})' for pattern in regexes))
+            except re.error as e:
+                logging.error(f"Failed to combine the blacklist patterns, searching them one at a time. Error: {str(e)}")
+                self.separate.extend(re.compile(pattern) for pattern in regexes)
+
+    def _add_domain(self, domain):
+        node = self.domains
+        for char in domain:
+            node = node.setdefault(char, {})
+        # '' marks the end of a blacklisted domain
+        node[''] = True
+        self.domain_count += 1
+
+    @classmethod
+    def _trie_regex(cls, node):
+        if '' in node:
+            # Any longer domain below here contains this one, so it can't add a match
+            return ''
+        branches = [
+            # '.' stays a wildcard, as it was when every entry went through re.search
+            ('.' if char == '.' else re.escape(char)) + cls._trie_regex(child)
+            for char, child in sorted(node.items())
+        ]
+        return branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+
+    def matches(self, url):
+        if self.regex and self.regex.search(url):
+            return True
+        return any(pattern.search(url) for pattern in self.separate)
+
+    def __repr__(self):
+        return f"DomainBlacklist({self.domain_count} domains, {self.regex_count} patterns)"
+
+def load_blacklist_patterns():
+    with open("includes/blacklist-domains.txt", "r") as file:
+        # Strip whitespace and filter out empty lines
+        return [line.strip() for line in file if line.strip()]
+
+def load_domain_blacklist():
+    return DomainBlacklist(load_blacklist_patterns())
+
+def is_domain_blacklisted(url, blacklist):
+    return blacklist.matches(url)
+
+def get_post_url(post, blacklist):
+    """
+    Returns the article URL of a post if it should be summarized, otherwise None.
+    """
+    if (
+        "url_meta" not in post or 
+        not post["url_meta"] or 
+        "url" not in post["url_meta"] or 
+        post["url_meta"]["type"] != "general"
+    ):
+        print(f"Skipping post with ID {post['id']} as it doesn't meet criteria.")
+        return None
+
+    post_url = post["url_meta"]["url"]
+    if is_domain_blacklisted(post_url, blacklist):
+        return None
+    return post_url
+
+def get_summary_from_tldrthis(post_url):
+    """
+    Fetches a summarized version of the content from the provided post_url using tldrthis.com.
+    """
+    try:
+        # Make a GET request to the URL with the post URL as a parameter
+        response = http_request('GET', TLDRTHIS_URL, params={'text_url': post_url})
+        
+        # If the request was successful, extract and return the summary
+        if response.status_code == 200:
+            data = response.json()
+            return " ".join(data[1])
+        else:
+            logging.error(f"Failed to fetch summary for URL {post_url}. Status code: {response.status_code}")
+            return None
+
+    except Exception as e:
+        logging.error(f"Exception occurred while fetching summary for URL {post_url}. Error: {str(e)}")
+        return None
+
+def normalize_url(url):
+    """
+    Reduces an article URL to a cache key, so the same article cross-posted
+    with a different scheme, www. prefix, trailing slash, fragment or
+    tracking parameters maps to one entry.
+    """
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PARAM_PREFIXES)
+    )
+    return urlunsplit(('https', host, parts.path.rstrip('/') or '/', urlencode(query), ''))
+
+class SummaryCache:
+    """
+    On-disk summaries keyed by normalized article URL, with a TTL and a cap on
+    the number of entries beyond which the least recently used are evicted.
+    Concurrent lookups of the same URL share a single summarizer call.
+    """
+    def __init__(self, path=SUMMARY_CACHE_PATH, ttl=SUMMARY_CACHE_TTL, max_entries=SUMMARY_CACHE_MAX_ENTRIES):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "url TEXT PRIMARY KEY, summary TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS summaries_accessed ON summaries (accessed)")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url):
+        key = normalize_url(url)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT summary, created FROM summaries WHERE url = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self.db.execute("DELETE FROM summaries WHERE url = ?", (key,))
+                self.misses += 1
+                metrics.inc('tldrbot_summary_cache_total', result='miss')
+                return None
+            self.db.execute("UPDATE summaries SET accessed = ? WHERE url = ?", (now, key))
+            self.hits += 1
+            metrics.inc('tldrbot_summary_cache_total', result='hit')
+            return row[0]
+
+    def put(self, url, summary):
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO summaries (url, summary, created, accessed) VALUES (?, ?, ?, ?)",
+                (normalize_url(url), summary, now, now)
+            )
+            self.db.execute(
+                "DELETE FROM summaries WHERE url IN "
+                "(SELECT url FROM summaries ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def get_or_compute(self, url, compute):
+        summary = self.get(url)
+        if summary is not None:
+            return summary
+
+        key = normalize_url(url)
+        with self.lock:
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self.inflight[key] = Future()
+        if not owner:
+            # Another worker is already summarizing this article
+            summary = future.result()
+            if summary:
+                with self.lock:
+                    self.misses -= 1
+                    self.hits += 1
+                metrics.inc('tldrbot_summary_cache_total', result='shared')
+            return summary
+
+        try:
+            summary = compute(url)
+            if summary:
+                self.put(url, summary)
+            future.set_result(summary)
+            return summary
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def close(self):
+        self.db.close()
+
+def simhash(text, shingle=NEAR_DUP_SHINGLE):
+    """
+    Returns the 64-bit SimHash of a text's word shingles, or None for texts
+    too short to fingerprint reliably. Texts that share most of their
+    shingles differ in only a few bits.
+    """
+    words = re.findall(r"[a-z0-9']+", text.lower())
+    if len(words) < NEAR_DUP_MIN_WORDS:
+        return None
+    counts = [0] * 64
+    for index in range(len(words) - shingle + 1):
+        digest = hashlib.blake2b(' '.join(words[index:index + shingle]).encode(), digest_size=8).digest()
+        value = int.from_bytes(digest, 'big')
+        for bit in range(64):
+            counts[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if counts[bit] > 0)
+
+class NearDuplicateIndex:
+    """
+    On-disk SimHashes of summarized articles and their summaries, so a
+    syndicated story published under another URL reuses the summary of the
+    copy already seen. Any fingerprint within max_distance bits must match one
+    of max_distance + 1 bands exactly, so lookups only compare the rows that
+    share a band.
+    """
+    def __init__(self, path=NEAR_DUP_PATH, max_distance=NEAR_DUP_DISTANCE, ttl=SUMMARY_CACHE_TTL,
+                 max_entries=SUMMARY_CACHE_MAX_ENTRIES):
+        if not 0 <= max_distance <= 63:
+            raise ValueError(f"Near-duplicate distance must be between 0 and 63 bits, not {max_distance}")
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            "id INTEGER PRIMARY KEY, url TEXT NOT NULL, simhash INTEGER NOT NULL, summary TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS bands ("
+            "band INTEGER NOT NULL, value INTEGER NOT NULL, "
+            "fingerprint INTEGER NOT NULL REFERENCES fingerprints (id) ON DELETE CASCADE)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS bands_value ON bands (band, value)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS bands_fingerprint ON bands (fingerprint)")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_entries = max_entries
+        width = 64 // (max_distance + 1)
+        self.bands = [(start * width, 64 if start == max_distance else (start + 1) * width) for start in range(max_distance + 1)]
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _signed(value):
+        # SQLite integers are signed 64-bit, so 64-bit values are stored two's complement
+        return value - 2 ** 64 if value >= 2 ** 63 else value
+
+    def _band_values(self, fingerprint):
+        return [
+            (band, self._signed(fingerprint >> low & ((1 << (high - low)) - 1))) for band, (low, high) in enumerate(self.bands)
+        ]
+
+    def lookup(self, fingerprint):
+        """
+        Returns the summary of the closest stored article within max_distance
+        bits of the fingerprint, or None.
+        """
+        clauses = ' OR '.join('(b.band = ? AND b.value = ?)' for _ in self.bands)
+        params = [value for pair in self._band_values(fingerprint) for value in pair]
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT DISTINCT f.url, f.simhash, f.summary FROM bands b JOIN fingerprints f ON f.id = b.fingerprint "
+                f"WHERE ({clauses}) AND f.created >= ?",
+                params + [time.time() - self.ttl]
+            ).fetchall()
+            distances = [(bin((stored & (2 ** 64 - 1)) ^ fingerprint).count('1'), url, summary) for url, stored, summary in rows]
+            matches = sorted(match for match in distances if match[0] <= self.max_distance)
+            if matches:
+                self.hits += 1
+                metrics.inc('tldrbot_near_dup_total', result='hit')
+                return matches[0][2]
+            self.misses += 1
+            metrics.inc('tldrbot_near_dup_total', result='miss')
+            return None
+
+    def add(self, fingerprint, url, summary):
+        signed = self._signed(fingerprint)
+        with self.lock:
+            self.db.execute("BEGIN")
+            cursor = self.db.execute(
+                "INSERT INTO fingerprints (url, simhash, summary, created) VALUES (?, ?, ?, ?)",
+                (normalize_url(url), signed, summary, time.time())
+            )
+            self.db.executemany(
+                "INSERT INTO bands (band, value, fingerprint) VALUES (?, ?, ?)",
+                [(band, value, cursor.lastrowid) for band, value in self._band_values(fingerprint)]
+            )
+            self.db.execute(
+                "DELETE FROM fingerprints WHERE created < ? OR id IN "
+                "(SELECT id FROM fingerprints ORDER BY id DESC LIMIT -1 OFFSET ?)",
+                (time.time() - self.ttl, self.max_entries)
+            )
+            self.db.execute("COMMIT")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def close(self):
+        self.db.close()
+
+# Summarizers
+def split_into_sentences(text):
+    # Use regular expression to split sentences by common punctuation used at the end of sentences
+    return re.split(r'(?<=[.!?])\s+', text)
+
+def fetch_article(url, max_bytes=ARTICLE_MAX_BYTES):
+    """
+    Streams an article's HTML and returns (body, encoding), or None. Bodies
+    that are not HTML are dropped after the headers, and reading stops at
+    max_bytes, which is plenty for the article text of any news page.
+    """
+    try:
+        response = http_request('GET', url, headers=ARTICLE_HEADERS, stream=True)
+    except requests.RequestException as e:
+        logging.error(f"Failed to fetch article {url}. Error: {str(e)}")
+        return None
+
+    with contextlib.closing(response):
+        if response.status_code != 200:
+            logging.error(f"Failed to fetch article {url}. Status code: {response.status_code}")
+            return None
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type and content_type not in HTML_CONTENT_TYPES:
+            print(f"Skipping article {url} with content type {content_type}")
+            metrics.inc('tldrbot_article_fetches_total', outcome='not_html')
+            return None
+
+        chunks = []
+        size = 0
+        try:
+            for chunk in response.iter_content(ARTICLE_CHUNK_BYTES):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= max_bytes:
+                    metrics.inc('tldrbot_article_fetches_total', outcome='truncated')
+                    break
+            else:
+                metrics.inc('tldrbot_article_fetches_total', outcome='ok')
+        except requests.RequestException as e:
+            logging.error(f"Failed to read article {url}. Error: {str(e)}")
+            return None
+        metrics.inc('tldrbot_article_bytes_total', size)
+        # Only trust a declared charset; otherwise let the parser sniff it
+        encoding = response.encoding if 'charset=' in response.headers.get('Content-Type', '') else None
+        return b''.join(chunks)[:max_bytes], encoding
+
+_compiled_selectors = {}
+
+def content_selector(host):
+    """
+    Returns the compiled CONTENT_IDENTIFIERS selector for a host or any
+    domain it is under, or None.
+    """
+    labels = host.lower().split('.')
+    for index in range(len(labels) - 1):
+        domain = '.'.join(labels[index:])
+        if domain in CONTENT_IDENTIFIERS:
+            if domain not in _compiled_selectors:
+                import soupsieve
+                _compiled_selectors[domain] = soupsieve.compile(CONTENT_IDENTIFIERS[domain])
+            return _compiled_selectors[domain]
+    return None
+
+def is_avoided(element):
+    return element.name in AVOID_ELEMENTS or any(cls in AVOID_CLASSES for cls in element.get("class") or [])
+
+def extract_article_text(body, url, encoding=None):
+    """
+    Returns the paragraphs of an article's main content, from the known
+    selector for its site when there is one, or None.
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(body, HTML_PARSER, from_encoding=encoding)
+    for element in soup.find_all(['script', 'style', 'noscript', 'nav'] + AVOID_ELEMENTS):
+        element.decompose()
+
+    selector = content_selector(urlparse(url).hostname or '')
+    containers = selector.select(soup) if selector else []
+    if containers:
+        paragraphs = [p for container in containers for p in (container.find_all('p') or [container])]
+    else:
+        paragraphs = soup.find_all('p')
+
+    texts = [p.get_text(' ', strip=True) for p in paragraphs if not is_avoided(p)]
+    return '\n'.join(text for text in texts if len(text.split()) > 5) or None
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+def get_extract_pool():
+    """
+    Returns the process pool that parses articles, started on first use, or
+    None when EXTRACT_WORKERS is 0. Workers are spawned rather than forked,
+    since forking a process with running threads can copy held locks.
+    """
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None and EXTRACT_WORKERS > 0:
+            _extract_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _extract_pool
+
+def discard_extract_pool(pool):
+    """
+    Drops a broken extraction pool, so the next article starts a fresh one.
+    """
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is pool:
+            _extract_pool = None
+    pool.shutdown(wait=False)
+
+def shutdown_extract_pool():
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is not None:
+            _extract_pool.shutdown()
+            _extract_pool = None
+
+def fetch_article_text(url):
+    """
+    Downloads an article and returns the text of its paragraphs, or None.
+    Parsing runs in the extraction process pool, so it scales with cores
+    instead of competing with the network threads for the GIL; only the raw
+    bytes go in and the extracted text comes back. If a worker dies the pool
+    is replaced and the article is parsed in-thread; one that takes longer
+    than EXTRACT_TIMEOUT is given up on.
+    """
+    article = fetch_article(url)
+    if not article:
+        return None
+    body, encoding = article
+    with metrics.time('tldrbot_article_extract_seconds'):
+        pool = get_extract_pool()
+        if pool is None:
+            return extract_article_text(body, url, encoding)
+        try:
+            future = pool.submit(extract_article_text, body, url, encoding)
+            return future.result(timeout=EXTRACT_TIMEOUT)
+        except BrokenProcessPool:
+            logging.warning(f"Article extraction pool broke while parsing {url}, restarting it")
+            discard_extract_pool(pool)
+            return extract_article_text(body, url, encoding)
+        except FutureTimeoutError:
+            future.cancel()
+            logging.warning(f"Parsing {url} took longer than {EXTRACT_TIMEOUT:g}s, skipping it")
+            return None
+
+class Summarizer:
+    """
+    A way of turning an article URL into a summary. host() names the upstream
+    the call is bounded by in the concurrent modes.
+    """
+    name = None
+    # Whether the summarizer works from the article text, so summarize_text()
+    # can be handed text that was already downloaded
+    reads_article = True
+
+    def host(self, post_url):
+        return urlparse(post_url).netloc
+
+    def summarize(self, post_url):
+        text = fetch_article_text(post_url)
+        return self.summarize_text(text) if text else None
+
+    def summarize_text(self, text):
+        raise NotImplementedError
+
+    def summarize_article(self, post_url, text=None):
+        """
+        Summarizes an article from its URL and, when it was already
+        downloaded, its text.
+        """
+        if not self.reads_article:
+            return self.summarize(post_url)
+        return self.summarize_text(text) if text else None
+
+    def close(self):
+        pass
+
+class TldrThisSummarizer(Summarizer):
+    name = 'tldrthis'
+    reads_article = False
+
+    def host(self, post_url):
+        return TLDRTHIS_HOST
+
+    def summarize(self, post_url):
+        return get_summary_from_tldrthis(post_url)
+
+class RapidApiSummarizer(Summarizer):
+    """
+    tldrthis' extractive model on RapidAPI, which summarizes text we send it.
+    """
+    name = 'rapidapi'
+
+    def host(self, post_url):
+        return urlparse(RAPIDAPI_URL).netloc
+
+    def summarize_text(self, text):
+        headers = {
+            "content-type": "application/json",
+            "X-RapidAPI-Key": RAPIDAPI_KEY,
+            "X-RapidAPI-Host": RAPIDAPI_HOST
+        }
+        payload = {
+            "text": text,
+            "num_sentences": SUMMARY_SENTENCES
+        }
+        try:
+            response = http_request('POST', RAPIDAPI_URL, json=payload, headers=headers)
+            if response.status_code != 200:
+                logging.error(f"Failed to fetch summary from RapidAPI. Status code: {response.status_code}")
+                return None
+            # Join the summary sentences
+            return ' '.join(response.json().get("summary", [])) or None
+        except Exception as e:
+            logging.error(f"Exception occurred while fetching summary from RapidAPI. Error: {str(e)}")
+            return None
+
+class IdfModel:
+    """
+    Corpus-wide document frequencies over hashed terms, persisted between
+    runs. Each summarized article adds to the counts instead of refitting.
+    Saving adds this process's new counts to the file as it is then, under a
+    lock, so sharded workers don't overwrite each other's counts.
+    """
+    def __init__(self, path=IDF_MODEL_PATH, features=IDF_FEATURES):
+        import numpy as np
+
+        self.np = np
+        self.path = path
+        self.features = features
+        self.lock = threading.Lock()
+        self.df, self.documents = self._load()
+        # Counts added since the last save
+        self.new_df = np.zeros(features, dtype=np.int32)
+        self.new_documents = 0
+
+    def _load(self):
+        np = self.np
+        try:
+            with np.load(self.path) as model:
+                df, documents = model["df"], int(model["documents"])
+            if df.shape == (self.features,):
+                return df, documents
+            logging.error(f"IDF model {self.path} has {df.shape[0]} features, not {self.features}. Starting afresh.")
+        except FileNotFoundError:
+            pass
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile) as e:
+            # A file torn by a crash mid-save by an older version
+            logging.error(f"Failed to load IDF model {self.path}. Starting afresh. Error: {str(e)}")
+        return np.zeros(self.features, dtype=np.int32), 0
+
+    def update(self, terms):
+        """
+        Counts one document containing the given term ids and returns the
+        updated IDF weights of those terms.
+        """
+        np = self.np
+        terms = np.unique(terms)
+        with self.lock:
+            self.df[terms] += 1
+            self.documents += 1
+            self.new_df[terms] += 1
+            self.new_documents += 1
+            return np.log((1 + self.documents) / (1 + self.df[terms])) + 1
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}"
+        with self.lock, open(f"{self.path}.lock", 'w') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            df, documents = self._load()
+            df += self.new_df
+            documents += self.new_documents
+            # np.savez appends .npz to names without it, so write through a file object
+            with open(temp_path, 'wb') as file:
+                self.np.savez(file, df=df, documents=documents)
+            os.replace(temp_path, self.path)
+            self.df, self.documents = df, documents
+            self.new_df[:] = 0
+            self.new_documents = 0
+
+class ExtractiveSummarizer(Summarizer):
+    """
+    Summarizes in-process by picking the article's most central sentences.
+    Sentences become sparse TF-IDF vectors over hashed terms, weighted by the
+    shared IdfModel, and are ranked by TextRank over their cosine similarity.
+    """
+    name = 'extractive'
+
+    def __init__(self, num_sentences=SUMMARY_SENTENCES, idf_model=None):
+        import numpy as np
+        from scipy import sparse
+
+        self.np = np
+        self.sparse = sparse
+        self.num_sentences = num_sentences
+        self.idf = idf_model or IdfModel()
+
+    def summarize_text(self, text):
+        np, sparse = self.np, self.sparse
+        sentences = [sentence.strip() for sentence in split_into_sentences(text) if len(sentence.split()) > 5]
+        if len(sentences) <= self.num_sentences:
+            return ' '.join(sentences) or None
+
+        rows, columns = [], []
+        for row, sentence in enumerate(sentences):
+            for token in re.findall(r"[a-z0-9']+", sentence.lower()):
+                # crc32 rather than hash(), which changes between processes
+                rows.append(row)
+                columns.append(zlib.crc32(token.encode()) % self.idf.features)
+        if not columns:
+            return None
+        columns = np.array(columns)
+        terms, term_index = np.unique(columns, return_inverse=True)
+        weights = self.idf.update(terms)
+
+        # Duplicate (row, term) entries are summed into term frequencies
+        matrix = sparse.csr_matrix((np.ones(len(columns)), (rows, term_index)), shape=(len(sentences), len(terms)))
+        matrix = matrix.multiply(weights).tocsr()
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        matrix = sparse.diags(1 / np.maximum(norms, 1e-12)) @ matrix
+
+        similarity = (matrix @ matrix.T).toarray()
+        np.fill_diagonal(similarity, 0)
+        scores = self.textrank(similarity)
+        chosen = sorted(np.argsort(-scores)[:self.num_sentences])
+        return ' '.join(sentences[index] for index in chosen)
+
+    def textrank(self, similarity, iterations=50, tolerance=1e-6):
+        np = self.np
+        count = len(similarity)
+        totals = similarity.sum(axis=1, keepdims=True)
+        transition = np.divide(similarity, totals, out=np.full_like(similarity, 1 / count), where=totals > 0)
+        scores = np.full(count, 1 / count)
+        for _ in range(iterations):
+            updated = (1 - TEXTRANK_DAMPING) / count + TEXTRANK_DAMPING * transition.T @ scores
+            if np.abs(updated - scores).sum() < tolerance:
+                return updated
+            scores = updated
+        return scores
+
+    def close(self):
+        self.idf.save()
+
+def split_into_chunks(text, chunk_size=BART_CHUNK_PARAGRAPHS):
+    """
+    Split the content into chunks of given size.
+    """
+    paragraphs = text.split('\n')
+    chunks = [paragraphs[i:i+chunk_size] for i in range(0, len(paragraphs), chunk_size)]
+    return ['\n'.join(chunk) for chunk in chunks]
+
+class ChunkRequest:
+    def __init__(self, input_ids):
+        self.input_ids = input_ids
+        self.future = Future()
+        self.queued = time.monotonic()
+
+class BartSummarizer(Summarizer):
+    """
+    Abstractive summaries from a local BART model, as in old/tldrbot.py.
+    Articles are split into chunks, and chunks from every article in flight
+    go to one inference thread. It waits up to BART_MAX_WAIT seconds to fill
+    a batch of BART_MAX_BATCH, picks chunks of similar token length so
+    little padding is wasted, and runs a single padded generate() call.
+
+    Nothing is loaded until the first article needs summarizing, so runs
+    without new posts never pay for the model. With quantize, the model's
+    Linear layers are dynamically quantized to int8 for CPU inference. The
+    prepared model is saved to artifact_dir and loaded from there next time,
+    as long as the model name and quantize setting recorded beside it match.
+    """
+    name = 'bart'
+
+    def __init__(self, model_name=BART_MODEL_NAME, max_batch=BART_MAX_BATCH, max_wait=BART_MAX_WAIT,
+                 quantize=BART_QUANTIZE, artifact_dir=BART_ARTIFACT_DIR):
+        self.model_name = model_name
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.quantize = quantize
+        self.artifact_dir = artifact_dir
+        self.pending = []
+        self.condition = threading.Condition()
+        self.load_lock = threading.Lock()
+        self.stopping = False
+        self.chunks = 0
+        self.inference_seconds = 0.0
+        self.tokenizer = None
+        self.model = None
+        self.thread = None
+
+    def _ensure_loaded(self):
+        with self.load_lock:
+            if self.model is not None:
+                return
+            started = time.perf_counter()
+            self._load()
+            elapsed = time.perf_counter() - started
+            metrics.set('tldrbot_bart_load_seconds', elapsed)
+            print(f"Loaded BART model in {elapsed:.1f}s")
+            self.thread = threading.Thread(target=self._run, name='bart-batcher', daemon=True)
+            self.thread.start()
+
+    def _load(self):
+        import torch
+        from transformers import BartForConditionalGeneration, BartTokenizer
+
+        model_path = os.path.join(self.artifact_dir, 'model.pt')
+        if os.path.exists(model_path) and self._artifact_matches():
+            self.tokenizer = BartTokenizer.from_pretrained(self.artifact_dir)
+            try:
+                # The artifact is a whole pickled module, not just weights
+                self.model = torch.load(model_path, weights_only=False)
+            except TypeError:
+                self.model = torch.load(model_path)
+            self.model.eval()
+            return
+
+        self.tokenizer = BartTokenizer.from_pretrained(self.model_name)
+        model = BartForConditionalGeneration.from_pretrained(self.model_name, low_cpu_mem_usage=True).eval()
+        if self.quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        self.save_artifact()
+
+    def _artifact_settings(self):
+        return {'model_name': self.model_name, 'quantize': self.quantize}
+
+    def _artifact_matches(self):
+        try:
+            with open(os.path.join(self.artifact_dir, 'artifact.json')) as f:
+                settings = json.load(f)
+        except (OSError, ValueError):
+            settings = None
+        if settings != self._artifact_settings():
+            print(f"BART model artifact in {self.artifact_dir} was built with other settings, rebuilding it")
+            return False
+        return True
+
+    def save_artifact(self):
+        import torch
+
+        os.makedirs(self.artifact_dir, exist_ok=True)
+        settings_path = os.path.join(self.artifact_dir, 'artifact.json')
+        # Written last, so an interrupted save is rebuilt rather than trusted
+        if os.path.exists(settings_path):
+            os.remove(settings_path)
+        self.tokenizer.save_pretrained(self.artifact_dir)
+        torch.save(self.model, os.path.join(self.artifact_dir, 'model.pt'))
+        with open(settings_path, 'w') as f:
+            json.dump(self._artifact_settings(), f)
+        print(f"Saved BART model artifact to {self.artifact_dir}")
+
+    def summarize_text(self, text):
+        self._ensure_loaded()
+        chunk_requests = [
+            ChunkRequest(self.tokenizer(chunk, truncation=True, max_length=BART_MAX_INPUT_TOKENS)["input_ids"])
+            for chunk in split_into_chunks(text) if chunk.strip()
+        ]
+        with self.condition:
+            self.pending.extend(chunk_requests)
+            self.condition.notify()
+        summaries = [request.future.result() for request in chunk_requests]
+
+        # Limit the combined summary to a maximum of 7 sentences
+        sentences = split_into_sentences(' '.join(summaries))
+        return ' '.join(sentences[:BART_SUMMARY_SENTENCES]) or None
+
+    def _next_batch(self):
+        """
+        Waits for work and returns the next batch: the oldest chunk plus the
+        chunks closest to it in length.
+        """
+        with self.condition:
+            while not self.stopping:
+                if self.pending:
+                    deadline = self.pending[0].queued + self.max_wait
+                    remaining = deadline - time.monotonic()
+                    if len(self.pending) >= self.max_batch or remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                else:
+                    self.condition.wait()
+            if self.stopping:
+                for request in self.pending:
+                    request.future.set_exception(RuntimeError("BART summarizer closed"))
+                self.pending = []
+                return []
+            oldest = self.pending[0]
+            length = len(oldest.input_ids)
+            rest = sorted(self.pending[1:], key=lambda request: abs(len(request.input_ids) - length))
+            batch = [oldest] + rest[:self.max_batch - 1]
+            chosen = set(map(id, batch))
+            self.pending = [request for request in self.pending if id(request) not in chosen]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            try:
+                summaries = self._generate([request.input_ids for request in batch])
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            for request, summary in zip(batch, summaries):
+                request.future.set_result(summary)
+
+    def _generate(self, input_ids):
+        import torch
+
+        started = time.perf_counter()
+        inputs = self.tokenizer.pad({"input_ids": input_ids}, return_tensors='pt')
+        with torch.no_grad():
+            outputs = self.model.generate(inputs["input_ids"], attention_mask=inputs["attention_mask"], **BART_GENERATE_ARGS)
+        summaries = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+        elapsed = time.perf_counter() - started
+
+        self.chunks += len(input_ids)
+        self.inference_seconds += elapsed
+        metrics.observe('tldrbot_bart_batch_seconds', elapsed, batch_size=len(input_ids))
+        metrics.inc('tldrbot_bart_chunks_total', len(input_ids))
+        metrics.inc('tldrbot_bart_padding_tokens_total', len(input_ids) * max(map(len, input_ids)) - sum(map(len, input_ids)))
+        metrics.set('tldrbot_bart_chunks_per_second', self.chunks_per_second())
+        return summaries
+
+    def chunks_per_second(self):
+        return self.chunks / self.inference_seconds if self.inference_seconds else 0.0
+
+    def close(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join()
+        if self.chunks:
+            print(f"BART summarized {self.chunks} chunks at {self.chunks_per_second():.2f} chunks/sec")
+
+class ResilientSummarizer(Summarizer):
+    """
+    Guards a remote summarizer with a CircuitBreaker and bounds each summary
+    by SUMMARY_DEADLINE. With hedging on, an attempt still running after the
+    p95 of recent latencies gets a second attempt alongside it, and the first
+    summary wins; at most HEDGE_MAX_INFLIGHT hedges run at once.
+    """
+    def __init__(self, summarizer, hedge=HEDGE, deadline=SUMMARY_DEADLINE):
+        self.summarizer = summarizer
+        self.name = summarizer.name
+        self.reads_article = summarizer.reads_article
+        self.breaker = CircuitBreaker(summarizer.name)
+        self.hedge = hedge
+        self.deadline = deadline
+        self.latencies = collections.deque(maxlen=200)
+        self.lock = threading.Lock()
+        self.hedges = threading.Semaphore(HEDGE_MAX_INFLIGHT)
+        self.executor = ThreadPoolExecutor(max_workers=CONCURRENCY + HEDGE_MAX_INFLIGHT)
+
+    def host(self, post_url):
+        return self.summarizer.host(post_url)
+
+    def summarize(self, post_url):
+        return self._call(self.summarizer.summarize, post_url)
+
+    def summarize_text(self, text):
+        return self._call(self.summarizer.summarize_text, text)
+
+    def summarize_article(self, post_url, text=None):
+        return self._call(self.summarizer.summarize_article, post_url, text)
+
+    def hedge_delay(self):
+        """
+        Returns how long to wait before hedging, or None to not hedge.
+        """
+        if not self.hedge or self.breaker.state != CircuitBreaker.CLOSED:
+            return None
+        with self.lock:
+            samples = sorted(self.latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY, samples[int(0.95 * (len(samples) - 1))])
+
+    def _attempt(self, ticket, func, *args):
+        started = time.monotonic()
+        try:
+            result = func(*args)
+        except Exception as e:
+            logging.error(f"{self.name} summarizer failed. Error: {str(e)}")
+            result = None
+        elapsed = time.monotonic() - started
+        self.breaker.record(ticket, result is not None, elapsed)
+        if result is not None:
+            with self.lock:
+                self.latencies.append(elapsed)
+        return result
 
-def load_domain_blacklist():
-    with open("includes/blacklist-domains.txt", "r") as file:
-        # Strip whitespace and filter out empty lines
-        return [line.strip() for line in file if line.strip()]
+    def _hedged_attempt(self, ticket, func, *args):
+        try:
+            return self._attempt(ticket, func, *args)
+        finally:
+            self.hedges.release()
 
-def is_domain_blacklisted(url, blacklist):
-    for pattern in blacklist:
-        if re.search(pattern, url):
-            return True
-    return False
+    def _call(self, func, *args):
+        ticket = self.breaker.allow()
+        if ticket is None:
+            logging.error(f"Circuit for {self.name} is open. Skipping summary.")
+            return None
+        deadline = time.monotonic() + self.deadline
+        attempts = [self.executor.submit(self._attempt, ticket, func, *args)]
+        delay = self.hedge_delay()
+        if delay is not None:
+            done, _ = wait(attempts, timeout=delay)
+            if not done and self.hedges.acquire(blocking=False):
+                metrics.inc('tldrbot_hedged_requests_total', backend=self.name)
+                attempts.append(self.executor.submit(self._hedged_attempt, ticket, func, *args))
+        try:
+            for future in as_completed(attempts, timeout=max(0.0, deadline - time.monotonic())):
+                result = future.result()
+                if result is not None:
+                    if len(attempts) > 1:
+                        metrics.inc('tldrbot_hedge_wins_total', backend=self.name, attempt=str(attempts.index(future)))
+                    return result
+        except FutureTimeoutError:
+            # Attempts left running finish in the background and still count towards the breaker;
+            # queued ones would only reach the upstream after the result stopped mattering
+            logging.error(f"{self.name} summarizer missed its {self.deadline:.0f}s deadline.")
+            metrics.inc('tldrbot_summary_deadline_exceeded_total', backend=self.name)
+            for index, future in enumerate(attempts):
+                if future.cancel():
+                    # Never ran, so settle its breaker ticket and hedge slot here
+                    self.breaker.record(ticket, False, self.deadline)
+                    if index:
+                        self.hedges.release()
+        return None
 
-def get_summary_from_tldrthis(post_url):
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.summarizer.close()
+
+class RacingSummarizer(Summarizer):
     """
-    Fetches a summarized version of the content from the provided post_url using tldrthis.com.
+    Runs several summarizers on each article at once and returns the first
+    acceptable summary, one of at least RACE_MIN_WORDS words, to arrive
+    within RACE_DEADLINE. Backends that only need the URL start at once,
+    while the article is downloaded for the ones that read it. Attempts that
+    haven't started are cancelled; ones already running can't be
+    interrupted, so they finish in the background and only count towards
+    their backend's latency.
     """
-    # URL for tldrthis.com
-    url = "https://tldrthis.com/tldr/process-text/"
-    
-    try:
-        # Make a GET request to the URL with the post URL as a parameter
-        response = requests.get(url, params={'text_url': post_url})
-        
-        # If the request was successful, extract and return the summary
-        if response.status_code == 200:
-            data = response.json()
-            return " ".join(data[1])
-        else:
-            logging.error(f"Failed to fetch summary for URL {post_url}. Status code: {response.status_code}")
+    name = 'race'
+
+    def __init__(self, backends, deadline=RACE_DEADLINE):
+        self.backends = backends
+        # Only a race of article readers counts as one, so a 'local' near-duplicate
+        # check never makes the URL-only backends wait for the download
+        self.reads_article = all(backend.reads_article for backend in backends)
+        self.deadline = deadline
+        self.executor = ThreadPoolExecutor(max_workers=CONCURRENCY * len(backends))
+        self.lock = threading.Lock()
+        self.races = 0
+        self.wins = {backend.name: 0 for backend in backends}
+
+    def host(self, post_url):
+        # Each backend is bounded by its own upstream's rate limit
+        return self.name
+
+    def summarize(self, post_url):
+        return self._race(post_url, None, fetch=any(backend.reads_article for backend in self.backends))
+
+    def _attempt(self, backend, post_url, text):
+        started = time.monotonic()
+        try:
+            summary = backend.summarize_article(post_url, text)
+        except Exception as e:
+            logging.error(f"{backend.name} summarizer failed. Error: {str(e)}")
+            summary = None
+        outcome = 'failed' if not summary else 'too_short' if len(summary.split()) < RACE_MIN_WORDS else 'ok'
+        metrics.observe('tldrbot_summarizer_seconds', time.monotonic() - started, backend=backend.name, outcome=outcome)
+        return summary if outcome == 'ok' else None
+
+    def summarize_article(self, post_url, text=None):
+        return self._race(post_url, text)
+
+    def _enter(self, backends, post_url, text, attempts):
+        started = {self.executor.submit(self._attempt, backend, post_url, text): backend for backend in backends}
+        attempts.update(started)
+        return set(started)
+
+    def _race(self, post_url, text, fetch=False):
+        """
+        Races the backends that can work from what there is of the article,
+        and with fetch, downloads its text to start the rest once it arrives.
+        """
+        attempts = {}
+        pending = self._enter([backend for backend in self.backends if text or not backend.reads_article], post_url, text, attempts)
+        fetching = None
+        if text is None and fetch:
+            fetching = self.executor.submit(fetch_article_text, post_url)
+            pending.add(fetching)
+        if not pending:
             return None
 
-    except Exception as e:
-        logging.error(f"Exception occurred while fetching summary for URL {post_url}. Error: {str(e)}")
-        return None
+        deadline = time.monotonic() + self.deadline
+        winner = summary = None
+        try:
+            while pending and not winner:
+                done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+                if not done:
+                    logging.error(f"No summarizer finished within {self.deadline:.0f}s for {post_url}.")
+                    metrics.inc('tldrbot_race_deadline_exceeded_total')
+                    break
+                for future in done:
+                    if future is fetching:
+                        try:
+                            text = future.result()
+                        except Exception as e:
+                            logging.error(f"Failed to fetch article {post_url}. Error: {str(e)}")
+                            text = None
+                        if text:
+                            readers = [backend for backend in self.backends if backend.reads_article]
+                            pending |= self._enter(readers, post_url, text, attempts)
+                    elif not winner and future.result():
+                        winner, summary = attempts[future], future.result()
+        finally:
+            for future in attempts:
+                future.cancel()
 
-def send_reply(post_hash_id, overview):
-    headers = {'authorization': 'Bearer ' + SQUABBLES_TOKEN}
-    content = (
+        with self.lock:
+            self.races += 1
+            if winner:
+                self.wins[winner.name] += 1
+            for name, wins in self.wins.items():
+                metrics.set('tldrbot_race_win_rate', wins / self.races, backend=name)
+        if winner:
+            metrics.inc('tldrbot_race_wins_total', backend=winner.name)
+        return summary if winner else None
+
+    def stats(self):
+        with self.lock:
+            return {name: {"wins": wins, "win_rate": wins / self.races if self.races else 0.0} for name, wins in self.wins.items()}
+
+    def close(self):
+        print(f"Summarizer race results: {self.stats()}")
+        self.executor.shutdown(wait=False)
+        for backend in self.backends:
+            backend.close()
+
+def open_summarizer(kind=SUMMARIZER):
+    kinds = [name.strip() for name in kind.split(',') if name.strip()]
+    if len(kinds) > 1:
+        return RacingSummarizer([open_summarizer(name) for name in kinds])
+    if kind == 'tldrthis':
+        return ResilientSummarizer(TldrThisSummarizer())
+    if kind == 'rapidapi':
+        return ResilientSummarizer(RapidApiSummarizer())
+    if kind == 'extractive':
+        return ExtractiveSummarizer()
+    if kind == 'bart':
+        return BartSummarizer()
+    raise ValueError(f"Unknown summarizer {kind!r}")
+
+def uses_near_dups(summarizer, mode=NEAR_DUP):
+    """
+    Returns whether articles for the summarizer go through the near-duplicate
+    index. In 'local' mode only summarizers that download the article anyway
+    do; 'all' also downloads articles for remote summarizers to save their calls.
+    """
+    return mode == 'all' or (mode == 'local' and summarizer.reads_article)
+
+def open_near_dup_index(summarizers, mode=NEAR_DUP):
+    """
+    Returns a NearDuplicateIndex, or None when none of the summarizers use it.
+    """
+    if any(uses_near_dups(summarizer, mode) for summarizer in summarizers):
+        return NearDuplicateIndex()
+    return None
+
+def summarize_article(post_url, summarizer, near_dups=None):
+    """
+    Summarizes an article, reusing the summary of a near-duplicate article
+    when one has been summarized before.
+    """
+    if near_dups is None:
+        return summarizer.summarize(post_url)
+    text = fetch_article_text(post_url)
+    if not text:
+        return summarizer.summarize_article(post_url)
+
+    fingerprint = simhash(text)
+    if fingerprint is not None:
+        summary = near_dups.lookup(fingerprint)
+        if summary:
+            print(f"Reusing the summary of a near-duplicate article for {post_url}")
+            return summary
+    summary = summarizer.summarize_article(post_url, text)
+    if summary and fingerprint is not None:
+        near_dups.add(fingerprint, post_url, summary)
+    return summary
+
+def get_summary(post_url, summary_cache, summarizer, near_dups=None):
+    """
+    Returns the cached summary for the article, running the summarizer on a miss.
+    """
+    return summary_cache.get_or_compute(post_url, functools.partial(summarize_article, summarizer=summarizer, near_dups=near_dups))
+
+def render_reply(overview):
+    return (
         "This is the best TL;DR I could put together from this article:\n\n"
         "-----\n\n"
         f"{overview}\n\n"
         "-----\n\n"
         "I am a bot. Post feedback and suggestions to /s/ModBot. Want this bot in your community? DM @modbot with `!summarize community_name`."
     )
-    resp = requests.post(f'https://squabblr.co/api/posts/{post_hash_id}/reply', data={"content": content}, headers=headers)
-    resp.raise_for_status()
-    return resp.json()
-
-def update_gist(community_name, new_last_processed_id, communities_data):
-    for community in communities_data:
-        if community["community"] == community_name:
-            community["last_processed_id"] = new_last_processed_id
-            break
+
+def send_reply(post_hash_id, content):
+    headers = {'authorization': 'Bearer ' + SQUABBLES_TOKEN}
+    return http_request('POST', f'{SQUABBLR_API}/posts/{post_hash_id}/reply', data={"content": content}, headers=headers)
+
+def update_gist(communities_data):
     headers = {
         'Authorization': f'token {GIST_TOKEN}',
         'Content-Type': 'application/json'
@@ -92,56 +2054,1542 @@ def update_gist(community_name, new_last_processed_id, communities_data):
             }
         }
     }
-    response = requests.patch(f"https://api.github.com/gists/{GIST_ID}", headers=headers, json=data)
+    response = http_request('PATCH', f"{GITHUB_API}/gists/{GIST_ID}", headers=headers, json=data)
     response.raise_for_status()
     return response.json()
 
+def fetch_gist_data_fresh():
+    """
+    Reads the Gist through the API rather than the CDN-cached raw URL, which
+    can lag behind recent updates.
+    """
+    headers = {'Authorization': f'token {GIST_TOKEN}'}
+    response = http_request('GET', f"{GITHUB_API}/gists/{GIST_ID}", headers=headers)
+    response.raise_for_status()
+    return json.loads(response.json()["files"][FILE_NAME]["content"])
+
+# Reply Outbox
+class ReplyOutbox:
+    """
+    Rendered replies in SQLite, posted by a pool of OUTBOX_WORKERS threads
+    so a slow reply endpoint never holds up processing. Replies are keyed by
+    the post's hash_id, and a post only ever gets one reply: enqueue()
+    ignores posts already in the outbox, and a reply is marked as sending
+    before its request goes out. Replies that certainly
+    did not arrive (a connect timeout or a 429) are retried with backoff;
+    ones that may have arrived (a read timeout, a 5xx, or a process that
+    died mid-send) are marked ambiguous and never sent again.
+    """
+    def __init__(self, path=OUTBOX_PATH, workers=OUTBOX_WORKERS, max_attempts=OUTBOX_MAX_ATTEMPTS):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS replies ("
+            "hash_id TEXT PRIMARY KEY, community TEXT NOT NULL, post_id INTEGER NOT NULL, "
+            "content TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, "
+            "created REAL NOT NULL, next_attempt REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS replies_due ON replies (status, next_attempt)")
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition()
+        self.max_attempts = max_attempts
+        self.stopping = False
+        self.recover()
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def recover(self):
+        now = time.time()
+        with self.lock:
+            stale = self.db.execute(
+                "UPDATE replies SET status = 'ambiguous', updated = ? WHERE status = 'sending' AND (worker = ? OR updated < ?)",
+                (now, WORKER_ID, now - OUTBOX_STALE_SENDING)
+            ).rowcount
+        if stale:
+            logging.error(f"{stale} replies were being sent when a previous run stopped; not sending them again.")
+
+    def contains(self, hash_id):
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM replies WHERE hash_id = ?", (hash_id,)).fetchone() is not None
+
+    def enqueue(self, community_name, post_id, hash_id, content):
+        """
+        Stores a reply to be posted and returns whether it was new.
+        """
+        now = time.time()
+        with self.lock:
+            added = self.db.execute(
+                "INSERT OR IGNORE INTO replies (hash_id, community, post_id, content, status, created, next_attempt, updated) "
+                "VALUES (?, ?, ?, ?, 'pending', ?, ?, ?)",
+                (hash_id, community_name, post_id, content, now, now, now)
+            ).rowcount
+        metrics.inc('tldrbot_outbox_total', outcome='queued' if added else 'duplicate')
+        if added:
+            with self.wakeup:
+                self.wakeup.notify()
+        return bool(added)
+
+    def _claim(self):
+        now = time.time()
+        with self.lock:
+            while True:
+                row = self.db.execute(
+                    "SELECT hash_id, community, post_id, content, attempts, created FROM replies "
+                    "WHERE status = 'pending' AND next_attempt <= ? ORDER BY next_attempt LIMIT 1",
+                    (now,)
+                ).fetchone()
+                if row is None:
+                    return None
+                # Conditional, since sharded workers drain the same outbox
+                if self.db.execute(
+                    "UPDATE replies SET status = 'sending', worker = ?, updated = ? WHERE hash_id = ? AND status = 'pending'",
+                    (WORKER_ID, now, row[0])
+                ).rowcount:
+                    return row
+
+    def _run(self):
+        while True:
+            with self.wakeup:
+                if self.stopping:
+                    return
+            row = self._claim()
+            if row is None:
+                with self.wakeup:
+                    if not self.stopping:
+                        self.wakeup.wait(1.0)
+                continue
+            try:
+                self._send(*row)
+            except Exception as e:
+                logging.error(f"Unexpected error in reply outbox. Error: {str(e)}")
+
+    def _send(self, hash_id, community_name, post_id, content, attempts, created):
+        try:
+            with metrics.time('tldrbot_step_seconds', step='reply', community=community_name) as labels:
+                response = send_reply(hash_id, content)
+                labels['outcome'] = str(response.status_code)
+        except requests.ConnectTimeout as e:
+            outcome, reason = 'retry', e.__class__.__name__
+        except requests.RequestException as e:
+            outcome, reason = 'ambiguous', e.__class__.__name__
+        else:
+            reason = f"status code {response.status_code}"
+            if response.ok:
+                outcome = 'sent'
+            elif response.status_code == 429:
+                outcome = 'retry'
+            elif response.status_code < 500:
+                outcome = 'failed'
+            else:
+                outcome = 'ambiguous'
+
+        attempts += 1
+        if outcome == 'retry' and attempts >= self.max_attempts:
+            outcome = 'failed'
+        status = 'pending' if outcome == 'retry' else outcome
+        now = time.time()
+        next_attempt = now + backoff_delay(attempts) if outcome == 'retry' else now
+        with self.lock:
+            self.db.execute(
+                "UPDATE replies SET status = ?, attempts = ?, next_attempt = ?, updated = ? WHERE hash_id = ?",
+                (status, attempts, next_attempt, now, hash_id)
+            )
+        metrics.inc('tldrbot_outbox_total', outcome=outcome)
+        if outcome == 'sent':
+            metrics.observe('tldrbot_outbox_delay_seconds', now - created)
+            print(f"Reply sent for post with ID {post_id} for community {community_name}")
+        elif outcome == 'retry':
+            logging.warning(f"Failed to send reply for post with ID {post_id} ({reason}), retrying.")
+        elif outcome == 'failed':
+            logging.error(f"Failed to send reply for post with ID {post_id} ({reason}). Giving up.")
+        else:
+            logging.error(f"Reply for post with ID {post_id} may or may not have been posted ({reason}). Not retrying.")
+
+    def drain(self, timeout=OUTBOX_DRAIN_TIMEOUT):
+        """
+        Waits up to timeout seconds for queued replies to be sent and returns
+        how many are still waiting.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                remaining = self.db.execute(
+                    "SELECT COUNT(*) FROM replies WHERE status = 'pending' OR (status = 'sending' AND worker = ?)",
+                    (WORKER_ID,)
+                ).fetchone()[0]
+            metrics.set('tldrbot_outbox_pending', remaining)
+            if not remaining or time.monotonic() >= deadline:
+                return remaining
+            time.sleep(0.1)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.db.execute("SELECT status, COUNT(*) FROM replies GROUP BY status").fetchall())
+
+    def close(self):
+        try:
+            remaining = self.drain()
+            if remaining:
+                print(f"{remaining} replies left in the outbox for the next run")
+        finally:
+            with self.wakeup:
+                self.stopping = True
+                self.wakeup.notify_all()
+            for thread in self.threads:
+                thread.join()
+            print(f"Reply outbox: {self.stats()}")
+            self.db.close()
+
+# Community Registry
+class CommunitySettings:
+    """
+    One community's row in the registry. poll_interval, blacklist and
+    summarizer are None where the defaults apply.
+    """
+    def __init__(self, name, owner=None, enabled=True, poll_interval=None, blacklist=None, summarizer=None):
+        self.name = name
+        self.owner = owner
+        self.enabled = enabled
+        self.poll_interval = poll_interval
+        self.blacklist = blacklist
+        self.summarizer = summarizer
+
+class CommunityRegistry:
+    """
+    Per-community settings from includes/communities.csv, compiled into a
+    dict keyed by lowercased community name. Besides the Username and
+    Community columns, a row may set Enabled, PollInterval (seconds, fixed
+    instead of adaptive in daemon mode), Summarizer (as in
+    TLDRBOT_SUMMARIZER) and Blacklist: ';'-separated entries added to the
+    domain blacklist, where an entry starting with '-' exempts the community
+    from that entry of the global list. refresh() recompiles the file when
+    its modification time changes; a file that fails to compile leaves the
+    previous registry in place.
+    """
+    def __init__(self, path=COMMUNITY_REGISTRY_PATH, blacklist_patterns=()):
+        self.path = path
+        self.blacklist_patterns = list(blacklist_patterns)
+        self.communities = {}
+        self.stamp = None
+        self.refresh()
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def refresh(self):
+        """
+        Recompiles the registry if the file changed, and returns whether it did.
+        """
+        if not self.path:
+            return False
+        stamp = self._stamp()
+        if stamp == self.stamp:
+            return False
+        try:
+            communities = self._compile() if stamp else {}
+        except (OSError, ValueError) as e:
+            metrics.inc('tldrbot_registry_reloads_total', outcome='failed')
+            logging.error(f"Failed to load community registry {self.path}. Keeping the previous one. Error: {str(e)}")
+            self.stamp = stamp
+            return False
+        self.communities, self.stamp = communities, stamp
+        metrics.inc('tldrbot_registry_reloads_total', outcome='loaded')
+        print(f"Loaded community registry: {len(communities)} communities from {self.path}")
+        return True
+
+    def _compile(self):
+        communities = {}
+        blacklists = {}
+        with open(self.path, newline='') as file:
+            for line, row in enumerate(csv.DictReader(file), start=2):
+                row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+                name = row.get('community')
+                if not name:
+                    continue
+                enabled = row.get('enabled', '').lower()
+                if enabled not in ('', '1', 'true', 'yes', '0', 'false', 'no'):
+                    raise ValueError(f"line {line}: Enabled must be yes or no, not {row['enabled']!r}")
+                poll_interval = None
+                if row.get('pollinterval'):
+                    poll_interval = float(row['pollinterval'])
+                    if poll_interval <= 0:
+                        raise ValueError(f"line {line}: PollInterval must be positive")
+                overrides = tuple(entry.strip() for entry in row.get('blacklist', '').split(';') if entry.strip())
+                if overrides and overrides not in blacklists:
+                    # Rows sharing overrides share one compiled blacklist
+                    exempt = {entry[1:] for entry in overrides if entry.startswith('-')}
+                    blacklists[overrides] = DomainBlacklist(
+                        [pattern for pattern in self.blacklist_patterns if pattern not in exempt]
+                        + [entry for entry in overrides if not entry.startswith('-')]
+                    )
+                communities[name.lower()] = CommunitySettings(
+                    name, owner=row.get('username') or None, enabled=enabled not in ('0', 'false', 'no'),
+                    poll_interval=poll_interval, blacklist=blacklists.get(overrides),
+                    summarizer=row.get('summarizer') or None
+                )
+        return communities
+
+    def get(self, community_name):
+        settings = self.communities.get(community_name.lower())
+        return settings if settings is not None else CommunitySettings(community_name)
+
+    def enabled(self):
+        return [settings for settings in self.communities.values() if settings.enabled]
+
+# State Backends
+class StateBackend:
+    """
+    Where the community list and each community's last_processed_id live.
+    write_behind marks remote backends whose writes are worth batching.
+    """
+    name = None
+    write_behind = False
+
+    def load_communities(self):
+        raise NotImplementedError
+
+    def save(self, communities_data, changed):
+        """
+        Persists the communities whose last_processed_id is in changed.
+        """
+        raise NotImplementedError
+
+    def add_community(self, community_name, last_processed_id=0):
+        """
+        Starts tracking a community. Backends that save whole documents pick
+        it up from communities_data on their next save.
+        """
+        pass
+
+    def close(self):
+        pass
+
+class GistStateBackend(StateBackend):
+    name = 'Gist'
+    write_behind = True
+
+    def load_communities(self):
+        return fetch_gist_data()
+
+    def save(self, communities_data, changed):
+        # The Gist only takes whole documents
+        update_gist(communities_data)
+
+class SQLiteStateBackend(StateBackend):
+    """
+    Local SQLite store in WAL mode. When a mirror is attached, the Gist is
+    merged in on startup and kept up to date by the mirror's background thread.
+    Startup only needs the Gist while the local store is still empty.
+    """
+    name = 'SQLite'
+
+    def __init__(self, path=STATE_DB_PATH, mirror=None):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS communities ("
+            "community TEXT PRIMARY KEY, last_processed_id INTEGER NOT NULL DEFAULT 0, extra TEXT NOT NULL DEFAULT '{}')"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS workers (worker TEXT PRIMARY KEY, heartbeat REAL NOT NULL)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS leases (community TEXT PRIMARY KEY, worker TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        self.lock = threading.Lock()
+        self.mirror = mirror
+        if mirror:
+            try:
+                self.merge(mirror.pull())
+            except Exception as e:
+                # The Gist is only a mirror; local state is enough to run on
+                if not self.load_communities():
+                    raise
+                logging.error(f"Failed to pull state from Gist. Continuing from local state. Error: {str(e)}")
+            mirror.start(self)
+
+    def merge(self, communities_data):
+        """
+        Adds unknown communities and takes the higher last_processed_id of
+        each known one.
+        """
+        with self.lock:
+            self.db.execute("BEGIN")
+            for community in communities_data:
+                extra = {key: value for key, value in community.items() if key not in ("community", "last_processed_id")}
+                self.db.execute(
+                    "INSERT INTO communities (community, last_processed_id, extra) VALUES (?, ?, ?) "
+                    "ON CONFLICT (community) DO UPDATE SET "
+                    "last_processed_id = max(last_processed_id, excluded.last_processed_id)",
+                    (community["community"], community.get("last_processed_id", 0), json.dumps(extra))
+                )
+            self.db.execute("COMMIT")
+
+    def add_community(self, community_name, last_processed_id=0):
+        self.merge([{"community": community_name, "last_processed_id": last_processed_id}])
+        if self.mirror:
+            self.mirror.mark_dirty()
+
+    def last_processed_id(self, community_name):
+        with self.lock:
+            row = self.db.execute("SELECT last_processed_id FROM communities WHERE community = ?", (community_name,)).fetchone()
+        return row[0] if row else 0
+
+    def heartbeat(self, worker, ttl):
+        """
+        Marks a worker alive and renews its leases, forgets workers that have
+        missed their heartbeats for ttl seconds and returns the live workers.
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            self.db.execute(
+                "INSERT INTO workers (worker, heartbeat) VALUES (?, ?) "
+                "ON CONFLICT (worker) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (worker, now)
+            )
+            self.db.execute("UPDATE leases SET expires = ? WHERE worker = ?", (now + ttl, worker))
+            self.db.execute("DELETE FROM workers WHERE heartbeat < ?", (now - ttl,))
+            workers = [row[0] for row in self.db.execute("SELECT worker FROM workers ORDER BY worker")]
+            self.db.execute("COMMIT")
+        return workers
+
+    def acquire_lease(self, community_name, worker, ttl):
+        """
+        Takes the lease on a community unless another worker holds one that
+        has not expired, and returns whether the worker now holds it.
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO leases (community, worker, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (community) DO UPDATE SET worker = excluded.worker, expires = excluded.expires "
+                "WHERE leases.expires < ? OR leases.worker = excluded.worker",
+                (community_name, worker, now + ttl, now)
+            )
+            row = self.db.execute("SELECT worker FROM leases WHERE community = ?", (community_name,)).fetchone()
+        return row is not None and row[0] == worker
+
+    def release_lease(self, community_name, worker):
+        with self.lock:
+            self.db.execute("DELETE FROM leases WHERE community = ? AND worker = ?", (community_name, worker))
+
+    def leave(self, worker):
+        with self.lock:
+            self.db.execute("BEGIN")
+            self.db.execute("DELETE FROM leases WHERE worker = ?", (worker,))
+            self.db.execute("DELETE FROM workers WHERE worker = ?", (worker,))
+            self.db.execute("COMMIT")
+
+    def load_communities(self):
+        with self.lock:
+            rows = self.db.execute("SELECT community, last_processed_id, extra FROM communities ORDER BY rowid").fetchall()
+        return [dict(json.loads(extra), community=name, last_processed_id=last_processed_id) for name, last_processed_id, extra in rows]
+
+    def save(self, communities_data, changed):
+        with self.lock:
+            self.db.execute("BEGIN")
+            self.db.executemany(
+                "UPDATE communities SET last_processed_id = ? WHERE community = ? AND last_processed_id < ?",
+                [(post_id, community_name, post_id) for community_name, post_id in changed.items()]
+            )
+            self.db.execute("COMMIT")
+        if self.mirror:
+            self.mirror.mark_dirty()
+
+    def close(self):
+        try:
+            if self.mirror:
+                self.mirror.stop()
+        finally:
+            self.db.close()
+
+class GistMirror:
+    """
+    Copies local state to the Gist from a background thread, at most every
+    GIST_MIRROR_INTERVAL seconds and only after something changed.
+    """
+    def __init__(self, interval=GIST_MIRROR_INTERVAL):
+        self.interval = interval
+        self.changed = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.backend = None
+
+    def pull(self):
+        communities_data = fetch_gist_data_fresh()
+        print(f"Fetched data from Gist: {communities_data}")
+        return communities_data
+
+    def start(self, backend):
+        self.backend = backend
+        self.thread = threading.Thread(target=self._run, name='gist-mirror', daemon=True)
+        self.thread.start()
+
+    def mark_dirty(self):
+        self.changed.set()
+
+    def push(self):
+        self.changed.clear()
+        try:
+            update_gist(self.backend.load_communities())
+            print("Mirrored state to Gist")
+        except Exception as e:
+            self.changed.set()
+            logging.error(f"Failed to mirror state to Gist. Error: {str(e)}")
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            if self.changed.is_set():
+                self.push()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join()
+        if self.changed.is_set():
+            self.push()
+
+def open_state_backend(kind=STATE_BACKEND):
+    if kind == 'gist':
+        return GistStateBackend()
+    if kind == 'sqlite':
+        return SQLiteStateBackend(mirror=GistMirror() if GIST_MIRROR else None)
+    raise ValueError(f"Unknown state backend {kind!r}")
+
+class CheckpointManager:
+    """
+    Buffers last_processed_id advances and writes them to the state backend.
+    For write-behind backends such as the Gist, writes are batched until
+    CHECKPOINT_MAX_PENDING advances or CHECKPOINT_INTERVAL seconds have built
+    up, or flush() is called. Every advance is then appended to a local
+    journal first, and a journal left behind by a crashed run is replayed on
+    startup, so posts replied to before the crash are not replied to again.
+    Local backends are written through on every advance.
+    """
+    def __init__(self, communities_data, backend, journal_path=CHECKPOINT_JOURNAL,
+                 flush_interval=CHECKPOINT_INTERVAL, max_pending=CHECKPOINT_MAX_PENDING):
+        self.communities_data = communities_data
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending if backend.write_behind else 1
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.dirty = {}
+        self.pending = 0
+        self.last_flush = time.monotonic()
+        self.journal = None
+        if backend.write_behind:
+            self.recover(journal_path)
+            os.makedirs(os.path.dirname(journal_path) or '.', exist_ok=True)
+            self.journal = open(journal_path, 'a')
+
+    def recover(self, journal_path):
+        if not os.path.exists(journal_path):
+            return
+        with open(journal_path) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash mid-write
+                    continue
+                if self._apply(entry["community"], entry["last_processed_id"]):
+                    self.dirty[entry["community"]] = entry["last_processed_id"]
+                    self.pending += 1
+        if self.dirty:
+            print(f"Recovered unflushed checkpoints from journal: {self.dirty}")
+
+    def _apply(self, community_name, post_id):
+        for community in self.communities_data:
+            if community["community"] == community_name:
+                if post_id <= community["last_processed_id"]:
+                    return False
+                community["last_processed_id"] = post_id
+                return True
+        return False
+
+    def _write_journal(self, entries):
+        for community_name, post_id in entries:
+            self.journal.write(json.dumps({"community": community_name, "last_processed_id": post_id}) + "\n")
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def advance(self, community_name, post_id):
+        with self.lock:
+            if not self._apply(community_name, post_id):
+                return
+            if self.journal:
+                self._write_journal([(community_name, post_id)])
+            self.dirty[community_name] = post_id
+            self.pending += 1
+            due = self.pending >= self.max_pending or time.monotonic() - self.last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                snapshot = [dict(community) for community in self.communities_data]
+                flushed, self.dirty = self.dirty, {}
+                self.pending = 0
+            try:
+                with metrics.time('tldrbot_checkpoint_flush_seconds', backend=self.backend.name):
+                    self.backend.save(snapshot, flushed)
+            except Exception:
+                with self.lock:
+                    for community_name, post_id in flushed.items():
+                        self.dirty[community_name] = max(post_id, self.dirty.get(community_name, post_id))
+                    self.pending += len(flushed)
+                raise
+            with self.lock:
+                if self.journal:
+                    # Keep only the advances that arrived while the upload was in flight
+                    self.journal.seek(0)
+                    self.journal.truncate()
+                    self._write_journal(self.dirty.items())
+                self.last_flush = time.monotonic()
+            if self.backend.write_behind:
+                print(f"Flushed checkpoints to {self.backend.name}: {flushed}")
+
+    def refresh(self, community_name, post_id):
+        """
+        Catches up with an advance another worker made while it owned the community.
+        """
+        with self.lock:
+            self._apply(community_name, post_id)
+
+    def track(self, community):
+        with self.lock:
+            self.communities_data.append(community)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.journal:
+                self.journal.close()
+
+# Sharding
+class HashRing:
+    """
+    Consistent hashing of community names onto workers. Each worker gets
+    virtual_nodes points on the ring, so a worker joining or leaving mostly
+    moves communities to or from itself. assign() also caps each worker's
+    load, since a few dozen communities rarely hash evenly.
+    """
+    def __init__(self, workers, virtual_nodes=SHARD_VIRTUAL_NODES):
+        self.workers = sorted(workers)
+        self.points = sorted((self._hash(f"{worker}#{index}"), worker) for worker in workers for index in range(virtual_nodes))
+        self.keys = [point for point, _ in self.points]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+    def owner(self, key):
+        if not self.points:
+            return None
+        return self.points[bisect.bisect(self.keys, self._hash(key)) % len(self.points)][1]
+
+    def assign(self, keys, load_factor=SHARD_LOAD_FACTOR):
+        """
+        Maps each key to its owner, passing a key on clockwise to the next
+        worker once its owner has its share. Every worker computes the same
+        assignment from the same keys and workers.
+        """
+        if not self.points:
+            return {}
+        capacity = -(-len(keys) * load_factor // len(self.workers))
+        loads = dict.fromkeys(self.workers, 0)
+        assignment = {}
+        for key in sorted(keys):
+            index = bisect.bisect(self.keys, self._hash(key))
+            while True:
+                worker = self.points[index % len(self.points)][1]
+                if loads[worker] < capacity:
+                    break
+                index += 1
+            loads[worker] += 1
+            assignment[key] = worker
+        return assignment
+
+class ShardCoordinator:
+    """
+    Splits communities between the workers sharing a SQLite state store.
+    Workers heartbeat into the store, each community belongs to one live
+    worker on a HashRing, and a worker only processes a community while it
+    holds the community's lease. Leases are renewed with every heartbeat, so
+    a dead worker's leases expire after LEASE_TTL seconds and its share of the
+    ring passes to the workers still heartbeating.
+    """
+    def __init__(self, backend, community_names, worker_id=WORKER_ID, lease_ttl=LEASE_TTL):
+        if not isinstance(backend, SQLiteStateBackend):
+            raise ValueError("Sharding needs the sqlite state backend")
+        self.backend = backend
+        self.community_names = list(community_names)
+        self.worker_id = worker_id
+        self.lease_ttl = lease_ttl
+        self.ring = HashRing([])
+        self.assignment = {}
+        self.stopped = threading.Event()
+        self.beat()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def beat(self):
+        workers = self.backend.heartbeat(self.worker_id, self.lease_ttl)
+        if workers != self.ring.workers:
+            print(f"Worker {self.worker_id} sharing communities with workers: {workers}")
+            metrics.set('tldrbot_shard_workers', len(workers))
+            self.ring = HashRing(workers)
+            self.assignment = self.ring.assign(self.community_names)
+
+    def add(self, community_names):
+        self.community_names.extend(community_names)
+        self.assignment = self.ring.assign(self.community_names)
+
+    def _run(self):
+        while not self.stopped.wait(self.lease_ttl / 3):
+            try:
+                self.beat()
+            except Exception as e:
+                logging.error(f"Failed to send worker heartbeat. Error: {str(e)}")
+
+    def acquire(self, community_name):
+        """
+        Returns whether this worker owns the community and now holds its lease.
+        """
+        # Refresh membership first, so workers started together split the work from the start
+        self.beat()
+        if self.assignment.get(community_name, self.ring.owner(community_name)) != self.worker_id:
+            return False
+        return self.backend.acquire_lease(community_name, self.worker_id, self.lease_ttl)
+
+    def release(self, community_name):
+        self.backend.release_lease(community_name, self.worker_id)
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.backend.leave(self.worker_id)
+
+class BotContext:
+    """
+    The state a run shares across communities.
+    """
+    def __init__(self, backend=None):
+        self.backend = backend or open_state_backend()
+        self.communities_data = self.backend.load_communities()
+        self.checkpoints = CheckpointManager(self.communities_data, self.backend)
+        self.shards = ShardCoordinator(self.backend, [community["community"] for community in self.communities_data]) if SHARDING else None
+        blacklist_patterns = load_blacklist_patterns()
+        self.domain_blacklist = DomainBlacklist(blacklist_patterns)
+        print(f"Loaded domain blacklist: {self.domain_blacklist}")
+        self.summary_cache = SummaryCache()
+        self.summarizer = open_summarizer()
+        self.summarizers = {SUMMARIZER: self.summarizer}
+        self.near_dups = None
+        self.validators = ListingValidators()
+        self.outbox = ReplyOutbox()
+        self.registry = CommunityRegistry(blacklist_patterns=blacklist_patterns)
+        self._apply_registry()
+
+    def refresh_registry(self):
+        """
+        Picks up changes to the community registry file, and returns the
+        communities it added to the state backend. Communities that couldn't
+        be added last time are retried.
+        """
+        self.registry.refresh()
+        return self._apply_registry()
+
+    def _apply_registry(self):
+        for settings in self.registry.enabled():
+            kind = settings.summarizer
+            if kind and kind not in self.summarizers:
+                try:
+                    self.summarizers[kind] = open_summarizer(kind)
+                except (ValueError, ImportError) as e:
+                    logging.error(f"Failed to open summarizer {kind!r} for community {settings.name}. Using {SUMMARIZER}. Error: {str(e)}")
+                    self.summarizers[kind] = self.summarizer
+        if self.near_dups is None:
+            self.near_dups = open_near_dup_index(self.summarizers.values())
+
+        # Registered communities join the ones the state backend already tracks,
+        # from their newest post on
+        known = {community["community"].lower() for community in self.communities_data}
+        added = []
+        for settings in self.registry.enabled():
+            if settings.name.lower() in known:
+                continue
+            try:
+                last_processed_id = latest_post_id(settings.name)
+            except Exception as e:
+                logging.error(f"Failed to read the newest post of community {settings.name}. Not adding it yet. Error: {str(e)}")
+                continue
+            self.backend.add_community(settings.name, last_processed_id)
+            community = {"community": settings.name, "last_processed_id": last_processed_id}
+            self.checkpoints.track(community)
+            added.append(community)
+        if added:
+            print(f"Added communities from the registry: {[community['community'] for community in added]}")
+            if self.shards:
+                self.shards.add([community["community"] for community in added])
+        return added
+
+    def settings(self, community):
+        return self.registry.get(community["community"])
+
+    def active_communities(self):
+        return [community for community in self.communities_data if self.settings(community).enabled]
+
+    def blacklist_for(self, community):
+        return self.settings(community).blacklist or self.domain_blacklist
+
+    def summarizer_for(self, community):
+        return self.summarizers.get(self.settings(community).summarizer, self.summarizer)
+
+    def near_dups_for(self, community):
+        """
+        Returns the near-duplicate index for the community's summarizer, or None.
+        """
+        if self.near_dups is not None and uses_near_dups(self.summarizer_for(community)):
+            return self.near_dups
+        return None
+
+    def claim(self, community):
+        """
+        Returns whether this worker should process the community now, and
+        brings its last_processed_id up to date when it does.
+        """
+        if self.shards is None:
+            return True
+        community_name = community["community"]
+        if not self.shards.acquire(community_name):
+            return False
+        self.checkpoints.refresh(community_name, self.backend.last_processed_id(community_name))
+        return True
+
+    def release(self, community):
+        if self.shards is not None:
+            self.shards.release(community["community"])
+
+    def flush(self):
+        self.checkpoints.flush()
+        self.validators.save()
+        metrics.dump()
+
+    def close(self):
+        try:
+            self.outbox.close()
+            self.checkpoints.close()
+            self.validators.save()
+            if self.shards:
+                self.shards.close()
+        finally:
+            print(f"Summary cache: {self.summary_cache.stats()}")
+            self.summary_cache.close()
+            if self.near_dups:
+                print(f"Near-duplicate articles: {self.near_dups.stats()}")
+                self.near_dups.close()
+            for summarizer in set(self.summarizers.values()):
+                summarizer.close()
+            shutdown_extract_pool()
+            self.backend.close()
+            close_session()
+            metrics.dump()
+            print(f"Wrote run metrics to {METRICS_JSON_PATH} and {METRICS_PROM_PATH}")
+
 # Main Execution
 def main():
     # Initialization
-    communities_data = fetch_gist_data()
-    domain_blacklist = load_domain_blacklist()
-    print(f"Loaded domain blacklist: {domain_blacklist}")
+    context = BotContext()
     
     # Processing
-    for community in communities_data:
-        print(f"Processing community: {community['community']}")
-        new_posts = fetch_new_posts(community["community"], community["last_processed_id"])
+    try:
+        skipped = []
+        for community in context.active_communities():
+            if not run_claimed(community, context):
+                skipped.append(community)
+        # Pick up what workers that have since finished or died left behind
+        for community in skipped:
+            run_claimed(community, context)
+    finally:
+        context.close()
 
-        if not new_posts:
-            print(f"No new posts found for community {community['community']}.")
+    print("TL;DR bot processing complete.")
+
+def run_claimed(community, context):
+    """
+    Processes a community if this worker can claim it, and returns whether it did.
+    """
+    if not context.claim(community):
+        return False
+    try:
+        process_community(community, context)
+    finally:
+        context.release(community)
+    if CHECKPOINT_FLUSH == 'community':
+        context.checkpoints.flush()
+    return True
+
+def process_community(community, context):
+    community_name = community["community"]
+    print(f"Processing community: {community_name}")
+    with metrics.time('tldrbot_step_seconds', step='listing', community=community_name) as labels:
+        new_posts = fetch_new_posts(community_name, community["last_processed_id"], context.validators)
+        labels['outcome'] = 'new_posts' if new_posts else 'no_new_posts'
+
+    if not new_posts:
+        print(f"No new posts found for community {community_name}.")
+        context.validators.commit(community_name)
+        return
+        
+    complete = True
+    for post in new_posts:
+        print(f"Processing post with ID {post['id']} for community {community_name}")
+
+        with metrics.time('tldrbot_step_seconds', step='filter', community=community_name) as labels:
+            post_url = get_post_url(post, context.blacklist_for(community))
+            labels['outcome'] = 'accepted' if post_url else 'skipped'
+        if not post_url:
+            metrics.inc('tldrbot_posts_total', community=community_name, outcome='skipped')
+            # Filtered posts are never coming back, so the next listing can stop before them
+            context.checkpoints.advance(community_name, post["id"])
+            continue
+
+        if context.outbox.contains(post['hash_id']):
+            # Replied to by a run that stopped before its checkpoint
+            print(f"Reply already queued for post with ID {post['id']} for community {community_name}")
+            context.checkpoints.advance(community_name, post["id"])
+            continue
+
+        # Fetch the summary from the cache or the summarizer
+        with metrics.time('tldrbot_step_seconds', step='summarize', community=community_name) as labels:
+            overview = get_summary(post_url, context.summary_cache, context.summarizer_for(community), context.near_dups_for(community))
+            labels['outcome'] = 'ok' if overview else 'failed'
+    
+        if not overview:
+            logging.error(f"Failed to generate a summary for post with ID {post['id']}. Skipping.")
+            metrics.inc('tldrbot_posts_total', community=community_name, outcome='failed')
+            complete = False
             continue
-            
+        
+        # key_points = generate_key_points(article_content)
+        print(f"Summaries generated for post with ID {post['id']} for community {community_name}")
+        with metrics.time('tldrbot_step_seconds', step='enqueue', community=community_name):
+            context.outbox.enqueue(community_name, post['id'], post['hash_id'], render_reply(overview))
+        print(f"Reply queued for post with ID {post['id']} for community {community_name}")
+        metrics.inc('tldrbot_posts_total', community=community_name, outcome='replied')
+        with metrics.time('tldrbot_step_seconds', step='checkpoint', community=community_name):
+            context.checkpoints.advance(community_name, post["id"])
+
+    if complete:
+        context.validators.commit(community_name)
+    else:
+        context.validators.discard(community_name)
+
+# Concurrent Execution
+class AsyncRunner:
+    """
+    Runs the blocking upstream calls on a thread pool, bounded by a global limit
+    and a per-host limit so one slow host cannot take every slot.
+    """
+    def __init__(self, concurrency=CONCURRENCY, host_concurrency=HOST_CONCURRENCY):
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.global_limit = asyncio.Semaphore(concurrency)
+        self.host_concurrency = host_concurrency
+        self.host_limits = {}
+
+    async def call(self, host, func, *args):
+        if host not in self.host_limits:
+            self.host_limits[host] = asyncio.Semaphore(self.host_concurrency)
+        async with self.global_limit, self.host_limits[host]:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+class CommunityBatch:
+    """
+    The new posts fetched for one community, tracked until every one of them
+    has left the pipeline. Posts finish in any order, but last_processed_id
+    only advances past a post once every older post in the batch has finished.
+    It stops short of failed posts at the end of the batch, so they are
+    retried, but moves past replied and filtered ones. Pushed batches never
+    advance it, since posts older than a pushed one may not have arrived
+    yet; the next poll catches up past them.
+    """
+    def __init__(self, community, posts, pushed=False):
+        self.community = community
+        self.pushed = pushed
+        self.ids = [post['id'] for post in posts]
+        self.finished = set()
+        self.passed = set()
+        self.failed = False
+        self.position = 0
+        self.done = asyncio.get_running_loop().create_future()
+
+    def finish(self, post_id, failed=False):
+        """
+        Records a finished post and returns the id last_processed_id can
+        advance to, or None.
+        """
+        self.finished.add(post_id)
+        if not failed:
+            self.passed.add(post_id)
+        self.failed = self.failed or failed
+        advance_to = None
+        if self.pushed:
+            self.position = len(self.ids)
+            return None
+        while self.position < len(self.ids) and self.ids[self.position] in self.finished:
+            if self.ids[self.position] in self.passed:
+                advance_to = self.ids[self.position]
+            self.position += 1
+        return advance_to
+
+    @property
+    def complete(self):
+        return self.position == len(self.ids)
+
+class PostJob:
+    def __init__(self, batch, post):
+        self.batch = batch
+        self.post = post
+        self.post_url = None
+        self.overview = None
+        self.replied = False
+        self.failed = False
+
+class Pipeline:
+    """
+    Processes posts in stages connected by bounded queues: listing fetch,
+    filter, summarize, reply (queueing it in the outbox) and checkpoint. Each stage has its own pool of
+    workers, so a slow stage only holds up the work queued behind it, and a
+    full queue blocks the stage feeding it.
+    """
+    STAGES = ('fetch', 'filter', 'summarize', 'reply', 'checkpoint')
+
+    def __init__(self, runner, context, workers=None, queue_size=PIPELINE_QUEUE_SIZE):
+        self.runner = runner
+        self.context = context
+        self.workers = dict(PIPELINE_WORKERS, **(workers or {}))
+        self.queues = {stage: asyncio.Queue(maxsize=queue_size) for stage in self.STAGES}
+        self.handlers = {stage: getattr(self, f'_{stage}') for stage in self.STAGES}
+        self.tasks = []
+
+    def start(self):
+        for stage in self.STAGES:
+            for _ in range(self.workers[stage]):
+                self.tasks.append(asyncio.ensure_future(self._work(stage)))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def process(self, community):
+        """
+        Runs one community through the pipeline and returns the ids of its new
+        posts, once all of them have been checkpointed, or None when another
+        worker owns it.
+        """
+        done = asyncio.get_running_loop().create_future()
+        await self.queues['fetch'].put((community, done))
+        return await done
+
+    async def push(self, community, post):
+        """
+        Feeds a post announced by an ingestion event straight to the filter
+        stage, skipping the listing fetch.
+        """
+        batch = CommunityBatch(community, [post], pushed=True)
+        await self.queues['filter'].put(PostJob(batch, post))
+
+    async def _work(self, stage):
+        queue = self.queues[stage]
+        while True:
+            item = await queue.get()
+            metrics.set('tldrbot_queue_depth', queue.qsize(), stage=stage)
+            try:
+                await self.handlers[stage](item)
+            except Exception as e:
+                logging.error(f"Unexpected error in {stage} stage. Error: {str(e)}")
+                await self._fail(stage, item, e)
+            finally:
+                queue.task_done()
+
+    async def _fail(self, stage, item, error):
+        """
+        Settles whatever a failed handler was working on, so the process()
+        call waiting on it gets an answer.
+        """
+        if stage == 'fetch':
+            community, done = item
+            if not done.done():
+                await self._release(community)
+                done.set_exception(error)
+        elif stage != 'checkpoint':
+            # The post still has to leave through the checkpoint stage
+            item.failed = True
+            await self.queues['checkpoint'].put(item)
+        elif not item.batch.done.done():
+            batch = item.batch
+            if batch.pushed:
+                # Nothing waits on a pushed batch, and the error is logged already
+                batch.done.set_result(None)
+                return
+            self.context.validators.discard(batch.community["community"])
+            await self._release(batch.community)
+            batch.done.set_exception(error)
+
+    async def _release(self, community):
+        try:
+            await self.runner.call(LOCAL_HOST, self.context.release, community)
+        except Exception as e:
+            logging.error(f"Failed to release community {community['community']}. Error: {str(e)}")
+
+    async def _fetch(self, item):
+        community, done = item
+        community_name = community["community"]
+        try:
+            claimed = await self.runner.call(LOCAL_HOST, self.context.claim, community)
+        except Exception as e:
+            done.set_exception(e)
+            return
+        if not claimed:
+            done.set_result(None)
+            return
+
+        print(f"Processing community: {community_name}")
+        try:
+            with metrics.time('tldrbot_step_seconds', step='listing', community=community_name) as labels:
+                new_posts = await self.runner.call(
+                    SQUABBLR_HOST, fetch_new_posts, community_name, community["last_processed_id"], self.context.validators
+                )
+                labels['outcome'] = 'new_posts' if new_posts else 'no_new_posts'
+        except Exception as e:
+            await self.runner.call(LOCAL_HOST, self.context.release, community)
+            done.set_exception(e)
+            return
+
+        if not new_posts:
+            print(f"No new posts found for community {community_name}.")
+            self.context.validators.commit(community_name)
+            await self.runner.call(LOCAL_HOST, self.context.release, community)
+            done.set_result([])
+            return
+
+        batch = CommunityBatch(community, new_posts)
+
+        def settle(future):
+            if future.exception() is not None:
+                done.set_exception(future.exception())
+            else:
+                done.set_result([post['id'] for post in new_posts])
+        batch.done.add_done_callback(settle)
         for post in new_posts:
-            print(f"Processing post with ID {post['id']} for community {community['community']}")
-
-            if (
-                "url_meta" not in post or 
-                not post["url_meta"] or 
-                "url" not in post["url_meta"] or 
-                post["url_meta"]["type"] != "general"
-            ):
-                print(f"Skipping post with ID {post['id']} as it doesn't meet criteria.")
-                continue
-            
-            post_url = post["url_meta"]["url"]
-            if is_domain_blacklisted(post_url, domain_blacklist):
+            await self.queues['filter'].put(PostJob(batch, post))
+
+    async def _filter(self, job):
+        print(f"Processing post with ID {job.post['id']} for community {job.batch.community['community']}")
+        community_name = job.batch.community["community"]
+        with metrics.time('tldrbot_step_seconds', step='filter', community=community_name) as labels:
+            job.post_url = get_post_url(job.post, self.context.blacklist_for(job.batch.community))
+            labels['outcome'] = 'accepted' if job.post_url else 'skipped'
+        if job.post_url and await self.runner.call(LOCAL_HOST, self.context.outbox.contains, job.post['hash_id']):
+            # Replied to by a run that stopped before its checkpoint
+            print(f"Reply already queued for post with ID {job.post['id']} for community {community_name}")
+            job.replied = True
+            await self.queues['checkpoint'].put(job)
+            return
+        await self.queues['summarize' if job.post_url else 'checkpoint'].put(job)
+
+    async def _summarize(self, job):
+        community_name = job.batch.community["community"]
+        with metrics.time('tldrbot_step_seconds', step='summarize', community=community_name) as labels:
+            summarizer = self.context.summarizer_for(job.batch.community)
+            job.overview = await self.runner.call(
+                summarizer.host(job.post_url), get_summary, job.post_url, self.context.summary_cache, summarizer,
+                self.context.near_dups_for(job.batch.community)
+            )
+            labels['outcome'] = 'ok' if job.overview else 'failed'
+        if not job.overview:
+            logging.error(f"Failed to generate a summary for post with ID {job.post['id']}. Skipping.")
+            job.failed = True
+            await self.queues['checkpoint'].put(job)
+            return
+        print(f"Summaries generated for post with ID {job.post['id']} for community {job.batch.community['community']}")
+        await self.queues['reply'].put(job)
+
+    async def _reply(self, job):
+        community_name = job.batch.community["community"]
+        try:
+            with metrics.time('tldrbot_step_seconds', step='enqueue', community=community_name):
+                await self.runner.call(
+                    LOCAL_HOST, self.context.outbox.enqueue,
+                    community_name, job.post['id'], job.post['hash_id'], render_reply(job.overview)
+                )
+            job.replied = True
+            print(f"Reply queued for post with ID {job.post['id']} for community {community_name}")
+        except Exception as e:
+            logging.error(f"Failed to queue reply for post with ID {job.post['id']}. Error: {str(e)}")
+            job.failed = True
+        await self.queues['checkpoint'].put(job)
+
+    async def _checkpoint(self, job):
+        batch = job.batch
+        if batch.done.done():
+            # The batch already failed at an earlier post's checkpoint
+            return
+        community_name = batch.community["community"]
+        outcome = 'replied' if job.replied else 'failed' if job.failed else 'skipped'
+        metrics.inc('tldrbot_posts_total', community=community_name, outcome=outcome)
+        advance_to = batch.finish(job.post['id'], job.failed)
+        if advance_to is not None:
+            # advance() may flush to the Gist, so keep it off the event loop
+            with metrics.time('tldrbot_step_seconds', step='checkpoint', community=community_name):
+                await self.runner.call(GITHUB_HOST, self.context.checkpoints.advance, community_name, advance_to)
+        if not batch.complete:
+            return
+        if batch.pushed:
+            batch.done.set_result(None)
+            return
+
+        if batch.failed:
+            self.context.validators.discard(community_name)
+        else:
+            self.context.validators.commit(community_name)
+        if CHECKPOINT_FLUSH == 'community':
+            await self.runner.call(GITHUB_HOST, self.context.checkpoints.flush)
+        await self.runner.call(LOCAL_HOST, self.context.release, batch.community)
+        batch.done.set_result(None)
+
+async def main_async(concurrency=CONCURRENCY, host_concurrency=HOST_CONCURRENCY):
+    runner = AsyncRunner(concurrency, host_concurrency)
+    try:
+        context = await runner.call(GITHUB_HOST, BotContext)
+
+        communities = context.active_communities()
+        pipeline = Pipeline(runner, context)
+        pipeline.start()
+        try:
+            results = await asyncio.gather(*(
+                pipeline.process(community) for community in communities
+            ), return_exceptions=True)
+            # Pick up what workers that have since finished or died left behind
+            skipped = [index for index, result in enumerate(results) if result is None]
+            retried = await asyncio.gather(*(
+                pipeline.process(communities[index]) for index in skipped
+            ), return_exceptions=True)
+            for index, result in zip(skipped, retried):
+                results[index] = result
+        finally:
+            await pipeline.stop()
+            await runner.call(GITHUB_HOST, context.close)
+
+        for community, result in zip(communities, results):
+            if isinstance(result, Exception):
+                logging.error(f"Failed to process community {community['community']}. Error: {str(result)}")
+        print("TL;DR bot processing complete.")
+    finally:
+        runner.close()
+
+# Push Ingestion
+class IngestServer:
+    """
+    Accepts new-post events over HTTP and feeds them into a running pipeline,
+    so replies don't wait for the next poll. Events are POSTed to /events as
+    {"community": ..., "post": {...}} with the post as it appears in a
+    listing, or a list of them. Only the community and the post's id and
+    hash_id are taken from an event: the post itself is read back from the
+    community's newest listing page, fetched once per request, so a sender
+    can't point the bot at another community's posts or at URLs of its
+    choosing. Posts already replied to or behind last_processed_id are
+    dropped, as are posts for disabled communities, and polling still picks
+    up anything an event was never sent for. Without a token the endpoint
+    only listens on a loopback address.
+    """
+    LOOPBACK_HOSTS = ('127.0.0.1', '::1', 'localhost')
+
+    def __init__(self, port, loop, pipeline, context, token=INGEST_TOKEN, host=INGEST_HOST):
+        if not token and host not in self.LOOPBACK_HOSTS:
+            raise ValueError(f"Set TLDRBOT_INGEST_TOKEN to accept events on {host or 'every address'}")
+        self.loop = loop
+        self.pipeline = pipeline
+        self.context = context
+        self.token = token
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                status, body = server.handle(self)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                if status == 503:
+                    self.send_header('Retry-After', '1')
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def handle(self, request):
+        if request.path != '/events':
+            return 404, {"error": "not found"}
+        if self.token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {self.token}'):
+            metrics.inc('tldrbot_ingest_events_total', outcome='unauthorized')
+            return 401, {"error": "unauthorized"}
+        try:
+            length = int(request.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            return 400, {"error": "invalid Content-Length"}
+        if length > INGEST_MAX_BODY:
+            return 413, {"error": "body too large"}
+        try:
+            events = json.loads(request.rfile.read(length))
+        except ValueError:
+            metrics.inc('tldrbot_ingest_events_total', outcome='invalid')
+            return 400, {"error": "body is not JSON"}
+
+        results = []
+        listings = {}
+        for event in events if isinstance(events, list) else [events]:
+            outcome = self.ingest(event, listings)
+            metrics.inc('tldrbot_ingest_events_total', outcome=outcome)
+            results.append(outcome)
+        if 'busy' in results:
+            return 503, {"results": results}
+        return 202, {"results": results}
+
+    def listed_post(self, community_name, hash_id, listings):
+        if community_name not in listings:
+            response = http_request('GET', f'{SQUABBLR_API}/s/{community_name}/posts', params={'page': 1, 'sort': 'new'})
+            response.raise_for_status()
+            listings[community_name] = {post['hash_id']: post for post in response.json().get("data", [])}
+        return listings[community_name].get(hash_id)
+
+    def ingest(self, event, listings):
+        post = event.get("post") if isinstance(event, dict) else None
+        if not isinstance(post, dict) or not isinstance(post.get("id"), int) or not post.get("hash_id"):
+            return 'invalid'
+        community = next((
+            community for community in self.context.communities_data if community["community"] == event.get("community")
+        ), None)
+        if community is None:
+            return 'unknown_community'
+        if not self.context.settings(community).enabled:
+            return 'disabled'
+        if post["id"] <= community["last_processed_id"]:
+            return 'duplicate'
+        try:
+            listed = self.listed_post(community["community"], post["hash_id"], listings)
+        except Exception as e:
+            # Worth the sender retrying, like a full queue
+            logging.error(f"Failed to read back post with ID {post['id']} for community {community['community']}. Error: {str(e)}")
+            return 'busy'
+        if listed is None or listed.get("id") != post["id"]:
+            return 'unverified'
+        post = listed
+        future = asyncio.run_coroutine_threadsafe(self.pipeline.push(community, post), self.loop)
+        try:
+            # The filter queue is bounded, so a flood of events pushes back on senders
+            future.result(timeout=INGEST_ENQUEUE_TIMEOUT)
+        except FutureTimeoutError:
+            future.cancel()
+            return 'busy'
+        print(f"Received post with ID {post['id']} for community {community['community']}")
+        return 'accepted'
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# Daemon Mode
+class PollSchedule:
+    """
+    Picks each community's next poll interval from a moving average of its
+    post rate, aiming for POLL_TARGET_POSTS new posts per poll. Busy
+    communities are polled every POLL_MIN_INTERVAL seconds; every empty poll
+    decays the average, so quiet ones back off towards POLL_MAX_INTERVAL.
+    Only posts newer than any seen before count, since posts left above
+    last_processed_id, such as failed ones, are listed again on every poll.
+    """
+    def __init__(self, min_interval=POLL_MIN_INTERVAL, max_interval=POLL_MAX_INTERVAL, target_posts=POLL_TARGET_POSTS):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_posts = target_posts
+        self.rates = {}
+        self.last_polled = {}
+        self.newest = {}
+
+    def observe(self, community_name, post_ids, now):
+        newest = self.newest.get(community_name, 0)
+        new_posts = sum(1 for post_id in post_ids if post_id > newest)
+        self.newest[community_name] = max([newest, *post_ids])
+        last_polled = self.last_polled.get(community_name)
+        self.last_polled[community_name] = now
+        if last_polled is None:
+            # Nothing to measure a rate against yet
+            return self.min_interval
+
+        rate = new_posts / max(now - last_polled, 1e-3)
+        previous = self.rates.get(community_name)
+        rate = rate if previous is None else POLL_RATE_SMOOTHING * rate + (1 - POLL_RATE_SMOOTHING) * previous
+        self.rates[community_name] = rate
+        interval = self.target_posts / rate if rate > 0 else self.max_interval
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def failed(self, community_name, now):
+        # Poll a failing community as if it had gone quiet
+        return self.observe(community_name, [], now)
+
+async def run_daemon(concurrency=CONCURRENCY, host_concurrency=HOST_CONCURRENCY, metrics_port=METRICS_PORT,
+                     ingest_port=INGEST_PORT):
+    """
+    Keeps running, with state held in memory, and polls every community on
+    its own adaptive schedule until SIGINT or SIGTERM. The community registry
+    is checked for changes every REGISTRY_CHECK_INTERVAL seconds, and
+    communities added to it start polling straight away. With a metrics_port,
+    metrics are also served over HTTP. With an ingest_port, new posts are
+    pushed to an IngestServer and polling drops to a reconciliation sweep
+    every INGEST_RECONCILE_INTERVAL seconds.
+    """
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+
+    async def sleep_until_stopped(seconds):
+        try:
+            await asyncio.wait_for(stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def poll_forever(community):
+        community_name = community["community"]
+        while not stopping.is_set():
+            settings = context.settings(community)
+            if not settings.enabled:
+                # Disabled in the registry; check again in case it is enabled
+                await sleep_until_stopped(REGISTRY_CHECK_INTERVAL)
                 continue
+            try:
+                post_ids = await pipeline.process(community)
+                if post_ids is None:
+                    # Owned by another worker; check again in case it goes away
+                    await sleep_until_stopped(LEASE_TTL / 3)
+                    continue
+                interval = schedule.observe(community_name, post_ids, loop.time())
+                if settings.poll_interval:
+                    interval = settings.poll_interval
+                elif ingest_port:
+                    interval = INGEST_RECONCILE_INTERVAL
+            except Exception as e:
+                logging.error(f"Failed to process community {community_name}. Error: {str(e)}")
+                interval = schedule.failed(community_name, loop.time())
+            print(f"Next poll of community {community_name} in {interval:.0f}s")
+            await sleep_until_stopped(interval)
 
-            # Fetch the summary from tldrthis.com
-            overview = get_summary_from_tldrthis(post_url)
-        
-            if not overview:
-                logging.error(f"Failed to generate a summary for post with ID {post['id']}. Skipping.")
+    async def watch_registry():
+        pollers = []
+        while not stopping.is_set():
+            await sleep_until_stopped(REGISTRY_CHECK_INTERVAL)
+            try:
+                added = await runner.call(SQUABBLR_HOST, context.refresh_registry)
+            except Exception as e:
+                logging.error(f"Failed to reload the community registry. Error: {str(e)}")
                 continue
-            
-            # key_points = generate_key_points(article_content)
-            print(f"Summaries generated for post with ID {post['id']} for community {community['community']}")
-            send_reply(post['hash_id'], overview)
-            print(f"Reply sent for post with ID {post['id']} for community {community['community']}")
-            update_gist(community["community"], post["id"], communities_data)
+            pollers.extend(asyncio.ensure_future(poll_forever(community)) for community in added)
+        await asyncio.gather(*pollers)
 
-        print("TL;DR bot processing complete.")
+    async def flush_forever():
+        while not stopping.is_set():
+            await sleep_until_stopped(CHECKPOINT_INTERVAL)
+            try:
+                await runner.call(GITHUB_HOST, context.flush)
+            except Exception as e:
+                logging.error(f"Failed to flush checkpoints. Error: {str(e)}")
+
+    if metrics_port:
+        metrics.serve(metrics_port)
+        print(f"Serving metrics on {METRICS_HOST}:{metrics_port}")
+
+    runner = AsyncRunner(concurrency, host_concurrency)
+    try:
+        context = await runner.call(GITHUB_HOST, BotContext)
+        schedule = PollSchedule()
+        pipeline = Pipeline(runner, context)
+        pipeline.start()
+        ingest = None
+        try:
+            if ingest_port:
+                ingest = IngestServer(ingest_port, loop, pipeline, context)
+                print(f"Accepting new-post events on port {ingest_port}")
+            await asyncio.gather(
+                flush_forever(), watch_registry(), *(poll_forever(community) for community in list(context.communities_data))
+            )
+        finally:
+            if ingest:
+                ingest.close()
+            await pipeline.stop()
+            await runner.call(GITHUB_HOST, context.close)
+        print("TL;DR bot daemon stopped.")
+    finally:
+        runner.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replies to new Squabblr link posts with a TL;DR.")
+    parser.add_argument('--concurrent', action='store_true', help="poll every community and process posts at once")
+    parser.add_argument('--daemon', action='store_true', help="keep running and poll each community on an adaptive schedule")
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT, help="serve metrics over HTTP on this port in daemon mode")
+    parser.add_argument('--ingest-port', type=int, default=INGEST_PORT, help="accept new-post events over HTTP on this port in daemon mode")
+    parser.add_argument('--build-bart-artifact', action='store_true', help="prepare the local BART model artifact and exit")
+    parser.add_argument('--add-community', metavar='NAME', help="start tracking a community from its newest post in the local state store and exit")
+    parser.add_argument('--record', metavar='PATH', default=CAPTURE_RECORD_PATH, help="capture every upstream request and response to this file")
+    parser.add_argument('--replay', metavar='PATH', default=CAPTURE_REPLAY_PATH, help="serve upstream responses from this capture instead of the network")
+    parser.add_argument('--replay-speed', type=float, default=CAPTURE_REPLAY_SPEED, help="replay speed-up; 0 serves responses without delay")
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help="maximum upstream calls in flight")
+    parser.add_argument('--host-concurrency', type=int, default=HOST_CONCURRENCY, help="maximum upstream calls in flight per host")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    CAPTURE_RECORD_PATH, CAPTURE_REPLAY_PATH, CAPTURE_REPLAY_SPEED = args.record, args.replay, args.replay_speed
+    if CAPTURE_REPLAY_PATH:
+        rate_limiter.scale(CAPTURE_REPLAY_SPEED)
+    if args.build_bart_artifact:
+        BartSummarizer()._ensure_loaded()
+    elif args.add_community:
+        last_processed_id = latest_post_id(args.add_community)
+        backend = SQLiteStateBackend()
+        backend.add_community(args.add_community, last_processed_id)
+        backend.close()
+        print(f"Tracking community {args.add_community} from post ID {last_processed_id}")
+    elif args.daemon:
+        asyncio.run(run_daemon(args.concurrency, args.host_concurrency, args.metrics_port, args.ingest_port))
+    elif args.concurrent:
+        asyncio.run(main_async(args.concurrency, args.host_concurrency))
+    else:
+        main()
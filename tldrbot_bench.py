@@ -0,0 +1,514 @@
+"""
+End-to-end benchmark for tldrbot.py.
+
+Starts local stand-ins for the Squabblr API, tldrthis, the Gist API and the
+linked news site, runs
+the bot against synthetic communities and posts, and reports posts/sec,
+per-post latency percentiles and peak RSS. Per-post latency is measured by the
+Squabblr stand-in, from the first time a post is listed to the time its reply
+arrives.
+
+    python tldrbot_bench.py --communities 20 --posts 10 --mode concurrent
+
+In daemon and push modes the bot runs as a daemon while posts are published
+at --event-rate, measured from publication; push mode also announces each
+post to the bot's ingestion endpoint.
+
+    python tldrbot_bench.py --mode push --event-rate 5
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import signal
+import socket
+import urllib.request
+import glob
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+GIST_ID = 'bench'
+FILE_NAME = 'tldrbot.json'
+PAGE_SIZE = 20
+
+class StandIn:
+    """
+    A local HTTP server with injected latency, error rate and a share of
+    tail requests that take TAIL_FACTOR times as long. Subclasses
+    implement route(handler, method, path, query, body) and return
+    (status, payload, headers).
+    """
+    TAIL_FACTOR = 20
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0, tail=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.tail = tail
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self, method):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                stand_in.handle(self, method, parsed.path, parse_qs(parsed.query), body)
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def do_PATCH(self):
+                self._handle('PATCH')
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, handler, method, path, query, body):
+        with self.lock:
+            self.requests += 1
+            delay = self.latency * self.random.uniform(0.5, 1.5)
+            if self.random.random() < self.tail:
+                delay *= self.TAIL_FACTOR
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if delay:
+            time.sleep(delay)
+        if failed:
+            status, payload, headers = 503, {"error": "injected"}, {}
+        else:
+            status, payload, headers = self.route(handler, method, path, query, body)
+        if isinstance(payload, bytes):
+            data, content_type = payload, 'text/html; charset=utf-8'
+        else:
+            data, content_type = b'' if status == 304 else json.dumps(payload).encode(), 'application/json'
+        handler.send_response(status)
+        for key, value in headers.items():
+            handler.send_header(key, value)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def route(self, handler, method, path, query, body):
+        raise NotImplementedError
+
+class SquabblrStandIn(StandIn):
+    """
+    Serves paged sort=new listings with ETags and accepts replies, recording
+    when each post was first listed and when it was replied to.
+    """
+    def __init__(self, posts_by_community, **kwargs):
+        super().__init__(**kwargs)
+        self.posts_by_community = {
+            community: sorted(posts, key=lambda post: -post['id']) for community, posts in posts_by_community.items()
+        }
+        self.posts_by_hash = {post['hash_id']: post for posts in posts_by_community.values() for post in posts}
+        self.first_listed = {}
+        self.replied = {}
+        self.duplicate_replies = 0
+
+    def add_post(self, community, post):
+        with self.lock:
+            self.posts_by_community.setdefault(community, []).insert(0, post)
+            self.posts_by_hash[post['hash_id']] = post
+            # Latency of a post published mid-run counts from its publication
+            self.first_listed[post['hash_id']] = time.monotonic()
+
+    def route(self, handler, method, path, query, body):
+        parts = path.strip('/').split('/')
+        if method == 'GET' and len(parts) == 4 and parts[:2] == ['api', 's'] and parts[3] == 'posts':
+            with self.lock:
+                posts = list(self.posts_by_community.get(parts[2], []))
+            etag = f'"{parts[2]}-{posts[0]["id"] if posts else 0}"'
+            page = int(query.get('page', ['1'])[0])
+            if page == 1 and handler.headers.get('If-None-Match') == etag:
+                return 304, None, {'ETag': etag}
+            listed = posts[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+            now = time.monotonic()
+            with self.lock:
+                for post in listed:
+                    self.first_listed.setdefault(post['hash_id'], now)
+            return 200, {"data": listed}, {'ETag': etag}
+        if method == 'POST' and len(parts) == 4 and parts[:2] == ['api', 'posts'] and parts[3] == 'reply':
+            with self.lock:
+                if parts[2] in self.replied:
+                    self.duplicate_replies += 1
+                else:
+                    self.replied[parts[2]] = time.monotonic()
+                reply_id = len(self.replied)
+            return 200, {"id": reply_id}, {}
+        return 404, {}, {}
+
+    def latencies(self):
+        with self.lock:
+            return [replied - self.first_listed[hash_id] for hash_id, replied in self.replied.items() if hash_id in self.first_listed]
+
+class TldrThisStandIn(StandIn):
+    def route(self, handler, method, path, query, body):
+        text_url = query.get('text_url', [''])[0]
+        return 200, ["Title", [f"Synthetic summary of {text_url}.", "It has two sentences, which together run to a dozen words or so."]], {}
+
+class RapidApiStandIn(StandIn):
+    def route(self, handler, method, path, query, body):
+        text = json.loads(body).get("text", "")
+        sentences = [sentence for sentence in text.split('. ') if sentence][:5]
+        return 200, {"summary": sentences or ["Synthetic summary.", "It has two sentences."]}, {}
+
+class GistStandIn(StandIn):
+    """
+    Serves the raw file, the API read and PATCH updates of one Gist.
+    """
+    def __init__(self, communities_data, **kwargs):
+        super().__init__(**kwargs)
+        self.content = json.dumps(communities_data)
+        self.patches = 0
+
+    def route(self, handler, method, path, query, body):
+        if method == 'GET' and path == f'/raw/{FILE_NAME}':
+            return 200, json.loads(self.content), {}
+        if path == f'/gists/{GIST_ID}':
+            if method == 'PATCH':
+                with self.lock:
+                    self.patches += 1
+                    self.content = json.loads(body)["files"][FILE_NAME]["content"]
+            return 200, {"files": {FILE_NAME: {"content": self.content}}}, {}
+        return 404, {}, {}
+
+class ArticleStandIn(StandIn):
+    """
+    Serves a synthetic news article of about size_kb kilobytes for any path,
+    the same article every time for the same path. /syndicated/<story>/<id>
+    serves story <story> with an outlet-specific byline, like a wire story
+    republished by many sites.
+    """
+    WORDS = (
+        "the council said new budget plan would cut costs for local schools while "
+        "critics argued that transit funding was left behind as officials met with "
+        "residents to discuss housing prices energy bills and the coming election"
+    ).split()
+
+    def __init__(self, size_kb=40, **kwargs):
+        super().__init__(**kwargs)
+        self.size_kb = size_kb
+
+    def route(self, handler, method, path, query, body):
+        parts = path.strip('/').split('/')
+        story = '/'.join(parts[:2]) if parts[0] == 'syndicated' else path
+        rng = random.Random(zlib.crc32(story.encode()))
+        paragraphs, size = [], 0
+        while size < self.size_kb * 1024:
+            sentences = []
+            for _ in range(rng.randint(3, 6)):
+                words = [rng.choice(self.WORDS) for _ in range(rng.randint(8, 20))]
+                sentences.append(' '.join(words).capitalize() + '.')
+            paragraph = f"<p>{' '.join(sentences)}</p>"
+            paragraphs.append(paragraph)
+            size += len(paragraph)
+        page = (
+            f"<html><head><title>{path}</title></head><body>"
+            f"<nav><ul><li><a href='/'>Home</a></li></ul></nav>"
+            f"<article>{''.join(paragraphs)}<p>Republished by outlet {parts[-1]} with additional reporting.</p></article>"
+            f"<footer><p class='copyright'>Copyright notice for the bench news site.</p></footer>"
+            f"</body></html>"
+        )
+        return 200, page.encode(), {}
+
+def make_posts(communities, posts_per_community, unique_urls, blacklisted, seed, article_url, syndicated=0.0):
+    """
+    Builds synthetic listings. unique_urls is the fraction of posts that link
+    to an article no other post links to; the rest are cross-posts. Of the
+    unique links, syndicated is the fraction that are copies of a wire story
+    under their own URL.
+    """
+    rng = random.Random(seed)
+    posts_by_community = {}
+    post_id = 1000
+    shared = max(1, int(communities * posts_per_community * (1 - unique_urls)))
+    for index in range(communities):
+        community = f"bench{index}"
+        posts = []
+        for _ in range(posts_per_community):
+            post_id += 1
+            if rng.random() < blacklisted:
+                url = f"https://youtu.be/{post_id}"
+            elif rng.random() < unique_urls:
+                if rng.random() < syndicated:
+                    url = f"{article_url}/syndicated/{rng.randrange(shared)}/{post_id}"
+                else:
+                    url = f"{article_url}/articles/{post_id}"
+            else:
+                url = f"{article_url}/shared/{rng.randrange(shared)}"
+            posts.append({"id": post_id, "hash_id": f"p{post_id}", "url_meta": {"type": "general", "url": url}})
+        posts_by_community[community] = posts
+    return posts_by_community
+
+class EventSource:
+    """
+    Publishes posts to the Squabblr stand-in at a steady rate and, given an
+    ingest_url, announces each one there the way a webhook relay would.
+    """
+    def __init__(self, squabblr, posts, rate, ingest_url=None):
+        self.squabblr = squabblr
+        self.posts = posts
+        self.rate = rate
+        self.ingest_url = ingest_url
+        self.sent_events = 0
+        self.rejected_events = 0  # answered, but not accepted
+        self.failed_events = 0  # never answered after every retry
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def announce(self, community, post):
+        request = urllib.request.Request(
+            self.ingest_url, data=json.dumps({"community": community, "post": post}).encode(),
+            headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        self.sent_events += 1
+        for _ in range(50):
+            try:
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    if json.loads(response.read())["results"] != ["accepted"]:
+                        self.rejected_events += 1
+                    return
+            except OSError:
+                # Not listening yet, or busy
+                time.sleep(0.1)
+        self.failed_events += 1
+
+    def run(self):
+        # Start once the bot is up and has polled
+        while not self.squabblr.requests:
+            time.sleep(0.05)
+        started = time.monotonic()
+        for index, (community, post) in enumerate(self.posts):
+            delay = started + index / self.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.squabblr.add_post(community, post)
+            if self.ingest_url:
+                self.announce(community, post)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def bot_env(squabblr, tldrthis, gist, state_dir, extra_env=None, rapidapi=None):
+    env = dict(os.environ)
+    if rapidapi:
+        env['RAPIDAPI_URL'] = f"{rapidapi.url}/v1/model/extractive/summarize-text/"
+    env.update({
+        'SQUABBLR_API': f"{squabblr.url}/api",
+        'TLDRTHIS_URL': f"{tldrthis.url}/tldr/process-text/",
+        'GITHUB_API': gist.url,
+        'TLDRBOT_GIST_URL': f"{gist.url}/raw/{FILE_NAME}",
+        'TLDRBOT_GIST': GIST_ID,
+        'GITHUB_TOKEN': 'bench',
+        'SQUABBLES_TOKEN': 'bench',
+        'TLDRBOT_STATE_DIR': state_dir,
+        # Communities come from the Gist stand-in, not the repo's registry
+        'TLDRBOT_COMMUNITIES': '',
+    })
+    env.update(extra_env or {})
+    return env
+
+def read_bot_metrics(state_dir):
+    """
+    Returns the counters of every worker's metrics file in state_dir.
+    """
+    counters = []
+    for path in glob.glob(os.path.join(state_dir, 'metrics*.json')):
+        try:
+            with open(path) as file:
+                counters.extend(json.load(file)["counters"])
+        except (OSError, ValueError, KeyError):
+            pass
+    return {"counters": counters}
+
+def counter_total(bot_metrics, name, **labels):
+    return sum(
+        counter["value"] for counter in bot_metrics["counters"]
+        if counter["name"] == name and all(counter["labels"].get(key) == value for key, value in labels.items())
+    )
+
+def run_bench(args):
+    articles = ArticleStandIn(args.article_kb, latency=args.article_latency, seed=args.seed + 3).start()
+    posts_by_community = make_posts(args.communities, args.posts, args.unique_urls, args.blacklisted, args.seed, articles.url, args.syndicated)
+    communities_data = [{"community": community, "last_processed_id": 1000} for community in posts_by_community]
+    streaming = args.mode in ('daemon', 'push')
+    if streaming:
+        # Publish the posts during the run, round-robin across communities
+        stream = [
+            (community, posts_by_community[community][index])
+            for index in range(args.posts) for community in posts_by_community
+        ]
+        posts_by_community = {community: [] for community in posts_by_community}
+    squabblr = SquabblrStandIn(posts_by_community, latency=args.squabblr_latency, error_rate=args.squabblr_errors, seed=args.seed).start()
+    tldrthis = TldrThisStandIn(latency=args.tldrthis_latency, error_rate=args.tldrthis_errors, seed=args.seed + 1, tail=args.tldrthis_tail).start()
+    rapidapi = RapidApiStandIn(latency=args.rapidapi_latency, error_rate=args.rapidapi_errors, seed=args.seed + 4).start()
+    gist = GistStandIn(communities_data, latency=args.gist_latency, error_rate=args.gist_errors, seed=args.seed + 2).start()
+
+    bot = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tldrbot.py')
+    command = [sys.executable, bot] + {'sequential': [], 'concurrent': ['--concurrent'], 'daemon': ['--daemon'], 'push': ['--daemon']}[args.mode]
+    ingest_port = free_port() if args.mode == 'push' else None
+    if ingest_port:
+        command += ['--ingest-port', str(ingest_port)]
+    try:
+        with tempfile.TemporaryDirectory() as state_dir:
+            started = time.monotonic()
+            extra_env = {'TLDRBOT_SUMMARIZER': args.summarizer, 'TLDRBOT_HEDGE': '1' if args.hedge else '0'}
+            if args.extract_workers is not None:
+                extra_env['TLDRBOT_EXTRACT_WORKERS'] = str(args.extract_workers)
+            if args.unthrottled:
+                hosts = (urlparse(stand_in.url).netloc for stand_in in (squabblr, tldrthis, gist, rapidapi))
+                extra_env['TLDRBOT_RATE_LIMITS'] = ','.join(f"{host}=0" for host in hosts)
+            if args.workers > 1:
+                extra_env['TLDRBOT_SHARDING'] = '1'
+            workers = [
+                subprocess.Popen(
+                    command, env=bot_env(squabblr, tldrthis, gist, state_dir, dict(extra_env, TLDRBOT_WORKER_ID=f"worker{index}"), rapidapi),
+                    cwd=os.path.dirname(bot), stdout=subprocess.DEVNULL if not args.verbose else None
+                )
+                for index in range(args.workers)
+            ]
+            source = None
+            if streaming:
+                ingest_url = f"http://127.0.0.1:{ingest_port}/events" if ingest_port else None
+                source = EventSource(squabblr, stream, args.event_rate, ingest_url).start()
+                expected = sum(1 for _, post in stream if 'youtu.be' not in post["url_meta"]["url"])
+                deadline = time.monotonic() + args.duration
+                while len(squabblr.replied) < expected and time.monotonic() < deadline:
+                    time.sleep(0.1)
+                for worker in workers:
+                    worker.send_signal(signal.SIGTERM)
+            exit_code = max(worker.wait() for worker in workers)
+            elapsed = time.monotonic() - started
+            bot_metrics = read_bot_metrics(state_dir)
+    finally:
+        for stand_in in (squabblr, tldrthis, gist, articles, rapidapi):
+            stand_in.stop()
+
+    latencies = squabblr.latencies()
+    return {
+        "mode": args.mode,
+        "summarizer": args.summarizer,
+        "workers": args.workers,
+        "exit_code": exit_code,
+        "communities": args.communities,
+        "posts": args.communities * args.posts,
+        "replies": len(squabblr.replied),
+        "duplicate_replies": squabblr.duplicate_replies,
+        "elapsed_seconds": elapsed,
+        "posts_per_second": len(squabblr.replied) / elapsed if elapsed else 0.0,
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_p99": percentile(latencies, 0.99),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        "upstream_requests": {"squabblr": squabblr.requests, "tldrthis": tldrthis.requests, "gist": gist.requests, "articles": articles.requests,
+                              "rapidapi": rapidapi.requests},
+        "upstream_errors": {"squabblr": squabblr.errors, "tldrthis": tldrthis.errors, "gist": gist.errors, "rapidapi": rapidapi.errors},
+        "race_wins": {
+            counter["labels"]["backend"]: counter["value"]
+            for counter in bot_metrics["counters"] if counter["name"] == 'tldrbot_race_wins_total'
+        },
+        "gist_patches": gist.patches,
+        "near_dup_hits": counter_total(bot_metrics, 'tldrbot_near_dup_total', result='hit'),
+        "near_dup_lookups": counter_total(bot_metrics, 'tldrbot_near_dup_total'),
+        "events": {
+            "sent": source.sent_events, "rejected": source.rejected_events, "failed": source.failed_events
+        } if source and source.ingest_url else None,
+    }
+
+def print_report(report):
+    print(f"mode:               {report['mode']}, {report['summarizer']} summarizer, {report['workers']} worker(s) (exit code {report['exit_code']})")
+    print(f"posts:              {report['posts']} across {report['communities']} communities")
+    print(f"replies:            {report['replies']} ({report['duplicate_replies']} duplicates)")
+    print(f"elapsed:            {report['elapsed_seconds']:.2f}s")
+    print(f"throughput:         {report['posts_per_second']:.2f} posts/sec")
+    print(f"per-post latency:   p50 {report['latency_p50']:.3f}s  p95 {report['latency_p95']:.3f}s  p99 {report['latency_p99']:.3f}s")
+    print(f"peak RSS:           {report['peak_rss_mb']:.1f} MB")
+    print(f"upstream requests:  {report['upstream_requests']} (errors {report['upstream_errors']})")
+    print(f"Gist PATCHes:       {report['gist_patches']}")
+    if report['race_wins']:
+        print(f"race wins:          {report['race_wins']}")
+    print(f"near-duplicates:    {report['near_dup_hits']} of {report['near_dup_lookups']} lookups")
+    if report['events']:
+        events = report['events']
+        print(f"pushed events:      {events['sent']} sent, {events['rejected']} rejected, {events['failed']} failed")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmarks tldrbot.py against local stand-in servers.")
+    parser.add_argument('--mode', choices=('sequential', 'concurrent', 'daemon', 'push'), default='sequential')
+    parser.add_argument('--event-rate', type=float, default=5.0, help="posts published per second in daemon and push modes")
+    parser.add_argument('--duration', type=float, default=120.0, help="longest to wait for replies in daemon and push modes")
+    parser.add_argument('--workers', type=int, default=1, help="bot processes sharding the communities between them")
+    parser.add_argument('--communities', type=int, default=10)
+    parser.add_argument('--posts', type=int, default=10, help="new posts per community")
+    parser.add_argument('--unique-urls', type=float, default=0.8, help="fraction of posts linking to an article no other post links to")
+    parser.add_argument('--syndicated', type=float, default=0.0, help="fraction of unique links that are copies of a wire story")
+    parser.add_argument('--blacklisted', type=float, default=0.05, help="fraction of posts linking to a blacklisted domain")
+    parser.add_argument('--summarizer', default='tldrthis', help="tldrthis, rapidapi, extractive, bart, or several comma-separated to race")
+    parser.add_argument('--article-kb', type=int, default=40, help="approximate size of each article page")
+    parser.add_argument('--extract-workers', type=int, help="article parsing processes (0 parses in the bot's threads)")
+    parser.add_argument('--squabblr-latency', type=float, default=0.05, help="mean response latency in seconds")
+    parser.add_argument('--tldrthis-latency', type=float, default=0.5)
+    parser.add_argument('--gist-latency', type=float, default=0.2)
+    parser.add_argument('--rapidapi-latency', type=float, default=0.3)
+    parser.add_argument('--rapidapi-errors', type=float, default=0.0)
+    parser.add_argument('--article-latency', type=float, default=0.1)
+    parser.add_argument('--squabblr-errors', type=float, default=0.0, help="fraction of requests answered with a 503")
+    parser.add_argument('--tldrthis-errors', type=float, default=0.0)
+    parser.add_argument('--tldrthis-tail', type=float, default=0.0, help="fraction of tldrthis requests that take 20x as long")
+    parser.add_argument('--hedge', action='store_true', help="hedge slow summarizer requests")
+    parser.add_argument('--gist-errors', type=float, default=0.0)
+    parser.add_argument('--unthrottled', action='store_true', help="turn off the bot's per-host rate limits")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    parser.add_argument('--verbose', action='store_true', help="show the bot's output")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run_bench(args)
+    if args.json:
+        print(json.dumps(report, indent=4))
+    else:
+        print_report(report)